@@ -1,21 +1,142 @@
 
-from pycparser import c_ast, parse_file, c_generator, c_parser
-from subprocess import Popen, PIPE, STDOUT
+from pycparser import c_ast, preprocess_file, c_parser
+import pycparser
 from collections import OrderedDict
+import collections
+import hashlib
+import json
+import struct
+import sys
+import shutil
 import os
 import argparse
+import time
+import contextlib
+import resource
+import threading
+import copy
+import re
+import signal
+import shlex
+import subprocess
+# c_generator, pickle, queue, socket, socketserver, multiprocessing, concurrent.futures, sqlite3
+# and tracemalloc are imported where they are used, a run with nothing to regenerate (a pre-commit
+# hook) does not need most of them. subprocess and threading are imported by pycparser anyway
 
 
 # array printer template
 array_printer = """
 void func() {{
 for(int _i = 0; _i < {size}; _i++) {{
-    printf("%x ", {name}[_i]);
+    printf("{fmt} ", {cast}{name}[_i]);
 }}
 printf("\\n");
 }}
 """
 
+# the generated tests print with printf and compare the state after the call with memcmp, math.h
+# has the NAN and INFINITY of the float buffers and stddef.h the max_align_t of their alignment
+self_check_includes = """#include <stdio.h>
+#include <string.h>
+#include <math.h>
+#include <stddef.h>"""
+# first line of the tests that check nothing, see run_test
+no_self_check = "/* no self check */"
+# line printed by the tests with --verbose_tests after the call, the lines before it are printed by the function
+after_call_marker = "__utg_after_call"
+
+# loader of the buffers larger than --inline_limit, written next to the test as raw bytes.
+# UTG_DATA_DIR can be set at compile time when the test and its data are moved
+sidecar_loader = """#include <stdio.h>
+#include <stdlib.h>
+#ifndef UTG_DATA_DIR
+#define UTG_DATA_DIR "{data_dir}"
+#endif
+static void __utg_load(void *dst, size_t size, const char *name) {{
+    char path[4096];
+    FILE *f;
+    snprintf(path, sizeof(path), "%s%s", UTG_DATA_DIR, name);
+    f = fopen(path, "rb");
+    if (!f || fread(dst, 1, size, f) != size) {{
+        fprintf(stderr, "cannot load %s\\n", path);
+        exit(1);
+    }}
+    fclose(f);
+}}
+"""
+
+########################################################################################
+#                                      PROFILE                                         #
+########################################################################################
+# --profile: wall time, cpu time of the child processes (cpp, clang, gdb, the program) and
+# peak python memory (tracemalloc) of each stage, per function where it applies.
+# Written as a chrome trace (chrome://tracing, ui.perfetto.dev), the totals per stage
+# are in otherData and printed at the end of the run
+class Profiler:
+    def __init__(self, path=None):
+        self.path = path
+        self.events = []
+        self.peaks = {} # thread -> running peak of each open stage, nested stages reset the tracemalloc peak
+        self.origin = time.perf_counter()
+        if path:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, func=None):
+        if not self.path:
+            yield
+            return
+        import tracemalloc
+        peaks = self.peaks.setdefault(threading.get_ident(), []) # the workloads are captured in threads
+        if peaks:
+            peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        peaks.append(0)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = time.process_time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            child_cpu = children_after.ru_utime - children.ru_utime + children_after.ru_stime - children.ru_stime
+            peak = max(peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if peaks:
+                peaks[-1] = max(peaks[-1], peak)
+            args = {"cpu_s": round(cpu, 6), "child_cpu_s": round(child_cpu, 6), "peak_kb": peak // 1024}
+            if func is not None:
+                args["func"] = func
+            self.events.append({"name": name if func is None else f"{name} {func}", "cat": name, "ph": "X",
+                                "ts": int((start - self.origin) * 1e6), "dur": int(wall * 1e6),
+                                "pid": os.getpid(), "tid": threading.get_native_id(), "args": args})
+
+    def summary(self):
+        stages = OrderedDict()
+        for event in self.events:
+            total = stages.setdefault(event["cat"], {"count": 0, "wall_s": 0.0, "cpu_s": 0.0, "child_cpu_s": 0.0, "peak_kb": 0})
+            total["count"] += 1
+            total["wall_s"] += event["dur"] / 1e6
+            total["cpu_s"] += event["args"]["cpu_s"]
+            total["child_cpu_s"] += event["args"]["child_cpu_s"]
+            total["peak_kb"] = max(total["peak_kb"], event["args"]["peak_kb"])
+        return stages
+
+    def write(self):
+        if not self.path:
+            return
+        stages = self.summary()
+        with open(self.path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms", "otherData": {"stages": stages}}, f, indent=1)
+        print(f"{'stage':<12}{'count':>7}{'wall s':>10}{'cpu s':>10}{'child s':>10}{'peak kb':>10}")
+        for name, total in sorted(stages.items(), key=lambda item: -item[1]["wall_s"]):
+            print(f"{name:<12}{total['count']:>7}{total['wall_s']:>10.3f}{total['cpu_s']:>10.3f}{total['child_cpu_s']:>10.3f}{total['peak_kb']:>10}")
+        print("Profile written to", self.path)
+
+
 class CFG:
     def __init__(self, args):
         self.tmp_folder = args.tmp_folder
@@ -23,6 +144,24 @@ class CFG:
         if not os.path.exists(self.tmp_folder):
             os.makedirs(self.tmp_folder)
         self.top = args.top
+        self.capture = getattr(args, "capture", "session")
+        self.invocations = getattr(args, "invocations", 1) # calls captured per function
+        self.sampling = getattr(args, "sampling", "stride")
+        self.stride = getattr(args, "stride", 1)
+        self.seed = getattr(args, "seed", 0)
+        self.jobs = getattr(args, "jobs", None) or os.cpu_count() or 1
+        self.force = getattr(args, "force", False) # ignore the manifest, regenerate everything
+        self.inline_limit = getattr(args, "inline_limit", 4096) # larger buffers go to a .bin file next to the test
+        self.verbose_tests = getattr(args, "verbose_tests", False) # the tests also print their state, checked against <test>.expected
+        self.cache_folder = getattr(args, "cache_folder", None) or self.tmp_folder # parse and build caches, shared in batch mode
+        self.cpp_args = [cpp_args] # plus the -I/-D/-U of the file in batch mode
+        self.gdb_pool = None # warm gdb sessions of --serve
+        self.validate = getattr(args, "validate", False) # build and run the tests after generating them
+        self.timeout = getattr(args, "timeout", 10) # seconds, per test
+        self.stage_timeout = getattr(args, "stage_timeout", 600) # seconds, per compiler, gdb or program run
+        self.memory_limit = (getattr(args, "memory_limit", 0) or 0) << 20 # bytes of resident memory per process, 0 for no limit
+        self.graph_depth = getattr(args, "graph_depth", 2) # levels of pointers followed from the parameters
+        self.graph_budget = getattr(args, "graph_budget", 1 << 20) # bytes captured per call past the parameters
         self.filename = args.file
         self.hierarchical_calls = []
         self.calls_table = {}
@@ -30,6 +169,15 @@ class CFG:
         self.nodes_table = {}
         self.params_pointers_table = {}
         self.structs_table = {}
+        self.typedefs_table = {}
+        self.struct_decls = {}
+        self.binary = None # instrumented binary, set by build_binary
+        self.units_table = {"includes": [], "headers": None, "units": [], "defined": {}} # see source_units
+        self.profiler = Profiler(getattr(args, "profile", None))
+        self.call_graph = None # CallGraph over calls_table, built on first use
+        self.workloads = load_workloads(args.workloads) if getattr(args, "workloads", None) else None # see load_workloads
+        self.index = getattr(args, "index", None) # sqlite index of the other files of the project, see INDEX
+        self.linked_files = [] # [(file, cpp args)] of the index, compiled and linked with the source
        
 #--------------------------------------------------------------------------------------#
 #                          FUNCTION CALL VISITOR CLASS                                 #
@@ -42,7 +190,8 @@ class FuncCallVisitor(c_ast.NodeVisitor):
 
     def visit_FuncCall(self, node):
         #print(self.name, " calls", node.name.name)
-        cfg.calls_table[self.name].append(node.name.name)
+        if isinstance(node.name, c_ast.ID): # calls through function pointers have no name
+            self.cfg.calls_table[self.name].append(node.name.name)
 
 
 #--------------------------------------------------------------------------------------#
@@ -52,14 +201,28 @@ class HierarchyVisitor(c_ast.NodeVisitor):
     def __init__(self, cfg):
         self.cfg = cfg
 
+    def visit_Typedef(self, node):
+        self.cfg.typedefs_table[node.name] = node.type
+        self.generic_visit(node)
+
+    def visit_Struct(self, node):
+        # struct definitions by name, references to them have no decls
+        if node.name is not None and node.decls is not None:
+            self.cfg.struct_decls[node.name] = node.decls
+        self.generic_visit(node)
+
     def visit_FuncDef(self, node):
         #print('%s at %s' % (node.decl.name, node.decl.coord))
         self.cfg.nodes_table[node.decl.name] = node
         self.cfg.calls_table[node.decl.name] = []
         self.cfg.params_table[node.decl.name] = []
         if node.decl.type.args:
-            self.cfg.params_table[node.decl.name] = [(param.type, param.name) for param in node.decl.type.args]
-            self.cfg.params_pointers_table[node.decl.name] = 1 in [1 if isinstance(param.type, c_ast.PtrDecl) or isinstance(param.type, c_ast.ArrayDecl) else 0 for param in node.decl.type.args]
+            args = [param for param in node.decl.type.args if not isinstance(param, c_ast.EllipsisParam)]
+            if len(args) == 1 and args[0].name is None and isinstance(args[0].type, c_ast.TypeDecl) \
+                    and isinstance(args[0].type.type, c_ast.IdentifierType) and args[0].type.type.names == ["void"]:
+                args = [] # f(void)
+            self.cfg.params_table[node.decl.name] = [(param.type, param.name) for param in args]
+            self.cfg.params_pointers_table[node.decl.name] = 1 in [1 if isinstance(param.type, c_ast.PtrDecl) or isinstance(param.type, c_ast.ArrayDecl) else 0 for param in args]
         v = FuncCallVisitor(node.decl.name, self.cfg)
         v.visit(node)
 
@@ -68,6 +231,9 @@ class HierarchyVisitor(c_ast.NodeVisitor):
 #                                 POINTER DATA CLASS                                   #
 #--------------------------------------------------------------------------------------#
 class PointerData():
+    # one per pointer parameter of every test, slots keep them small
+    __slots__ = ("byte_offset", "byte_size", "base", "type_size", "element_offset", "element_size", "type_names", "floating", "values")
+
     def __init__(self):
         self.byte_offset = 0     # this is in bytes
         self.byte_size = 0  # this is in bytes
@@ -75,314 +241,2930 @@ class PointerData():
         self.type_size = 0 # this is in bytes for each element
         self.element_offset = 0  # this is byte_offset/type_size
         self.element_size = 0 # this is in ellements
+        self.type_names = ['unsigned', 'char'] # element type the buffer is declared with
+        self.floating = False
+        self.values = None # decoded elements (see decode), None when the buffer goes to a sidecar file
+
+
+########################################################################################
+#                                   ELEMENT TYPE                                       #
+########################################################################################
+def element_type(param_type, cfg):
+    # scalar element type of a pointer/array parameter, going through typedefs and arrays
+    # e.g. state_t * -> uint8_t[4][4] -> uint8_t
+    # returns the names of the type to declare the buffer with, unsigned char for anything that is not a scalar.
+    # size and signedness come from the sizeof probe in gdb, the fake libc typedefs are not reliable for those
+    names = None
+    t = param_type.type
+    while True:
+        if isinstance(t, c_ast.ArrayDecl):
+            t = t.type
+        elif isinstance(t, c_ast.TypeDecl) and isinstance(t.type, c_ast.IdentifierType):
+            if names is None:
+                names = t.type.names
+            if len(t.type.names) == 1 and t.type.names[0] in cfg.typedefs_table:
+                t = cfg.typedefs_table[t.type.names[0]]
+                if isinstance(t, c_ast.ArrayDecl):
+                    names = None # typedef of an array, the element type is further down
+                continue
+            if t.type.names == ['void']:
+                return ['unsigned', 'char']
+            return names
+        else:
+            # struct, union, pointer or function: raw bytes
+            return ['unsigned', 'char']
+
+
+# memoryview formats of the element sizes the sizeof probe reports, (unsigned, signed, floating)
+typed_formats = {1: ("B", "b", None), 2: ("H", "h", None), 4: ("I", "i", "f"), 8: ("Q", "q", "d")}
+
+def decode(data, elem_size, signed, floating):
+    # raw bytes of a buffer, in the byte order of this machine which ran the program, to a sequence
+    # of elements: a typed memoryview over the captured bytes, not a copy, for the usual sizes
+    data = memoryview(data).cast("B")
+    fmt = typed_formats.get(elem_size, (None, None, None))[2 if floating else 1 if signed else 0]
+    if fmt is not None:
+        return data[:len(data) - len(data) % elem_size].cast(fmt)
+    if floating:
+        fmt = "=f" if elem_size == 4 else "=d"
+        return [value[0] for value in struct.iter_unpack(fmt, data[:len(data) - len(data) % elem_size])]
+    return [int.from_bytes(data[k:k+elem_size], sys.byteorder, signed=signed) for k in range(0, len(data) - elem_size + 1, elem_size)]
+
+
+def c_literal(value):
+    # decoded int or float to a c constant, NAN and INFINITY are from math.h
+    if isinstance(value, float):
+        if value != value:
+            return "NAN"
+        if value in (float("inf"), float("-inf")):
+            return "INFINITY" if value > 0 else "-INFINITY"
+        return repr(value)
+    if value > 0x7fffffffffffffff:
+        return f"{value}ULL" # above LLONG_MAX
+    if value < -0x7fffffffffffffff:
+        return "(-0x7fffffffffffffffLL - 1)" # LLONG_MIN, its digits do not fit a long long
+    return str(value)
+
+
+byte_texts = [str(byte) for byte in range(256)]
+
+def bulk_initializer(values, fmt=c_literal):
+    # {v0, v1, ...} of a buffer: an InitList of one node holding the joined texts, which the generator
+    # prints as it is, instead of one Constant node per element of large buffers
+    if fmt in (c_literal, str) and (isinstance(values, bytes) or getattr(values, "format", None) == "B"):
+        fmt = byte_texts.__getitem__ # bytes, the common case, from a table
+    return c_ast.InitList([c_ast.ID(", ".join(map(fmt, values)))])
 
 
 
+########################################################################################
+#                                   PARSE SOURCE                                       #
+########################################################################################
+# resolved against the tool, not the working directory, so that hooks and batch runs
+# can call it from anywhere
+tool_folder = os.path.dirname(os.path.abspath(__file__))
+cpp_args = "-I" + os.path.join(tool_folder, "utils", "fake_libc_include")
+parser_instance = None
+
+def shared_parser():
+    # one CParser per process, reused for every file and for the snippets of build_unit_test
+    global parser_instance
+    if parser_instance is None:
+        parser_instance = c_parser.CParser()
+    return parser_instance
+# tables filled by HierarchyVisitor, they are cached together with the ast
+parse_tables = ["calls_table", "params_table", "nodes_table", "params_pointers_table", "typedefs_table", "struct_decls", "units_table"]
+
+def parse_key(cfg):
+    # the raw source, the headers cpp reads for it (see source_dependencies), the cpp args and the pycparser version
+    _, digest = source_dependencies(cfg.filename, cfg.cpp_args, cfg)
+    return hashlib.sha256(f"{digest}:{' '.join(cfg.cpp_args)}:{pycparser.__version__}".encode()).hexdigest()
+
+
+def parse_source(cfg):
+    # runs cpp, pycparser and the visitors on cfg.filename, with an on-disk cache in tmp_folder/parse_cache/.
+    # Entries are keyed on the hash of the preprocessed source, index.json maps the raw source
+    # (and the headers it includes) to that hash, so that on a hit cpp does not run either.
+    # The tables do not depend on the top function, any --top in the same file hits the cache
+    import pickle
+    cache_dir = f"{cfg.cache_folder}parse_cache/"
+    os.makedirs(cache_dir, exist_ok=True)
+    raw_key = parse_key(cfg)
+    index_path = cache_dir + "index.json"
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    entry = index.get(raw_key)
+    if entry is None or not os.path.exists(f"{cache_dir}{entry}.pickle"):
+        with cfg.profiler.stage("preprocess"):
+            text = preprocess_file(cfg.filename, cpp_args=cfg.cpp_args)
+        entry = hashlib.sha256(f"{text}:{pycparser.__version__}".encode()).hexdigest()[:32]
+        index[raw_key] = entry
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(index_path + ".tmp", index_path)
+        if not os.path.exists(f"{cache_dir}{entry}.pickle"):
+            with cfg.profiler.stage("parse"):
+                ast = shared_parser().parse(text, cfg.filename)
+            with cfg.profiler.stage("visit"):
+                v = HierarchyVisitor(cfg)
+                v.visit(ast)
+            with cfg.profiler.stage("slice"):
+                cfg.units_table = source_units(ast, cfg)
+            del ast # the function definitions stay in nodes_table, the rest is in units_table
+            tables = {name: getattr(cfg, name) for name in parse_tables}
+            # the ast is deep, pickle recurses along it
+            limit = sys.getrecursionlimit()
+            sys.setrecursionlimit(max(limit, 100000))
+            try:
+                with open(f"{cache_dir}{entry}.pickle.tmp", "wb") as f:
+                    pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+            finally:
+                sys.setrecursionlimit(limit)
+            os.replace(f"{cache_dir}{entry}.pickle.tmp", f"{cache_dir}{entry}.pickle")
+            cfg.call_graph = None
+            return
+
+    print("Using cached parse", f"{cache_dir}{entry}.pickle", flush=True)
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 100000))
+    try:
+        with cfg.profiler.stage("parse_cache"), open(f"{cache_dir}{entry}.pickle", "rb") as f:
+            tables = pickle.load(f)
+    finally:
+        sys.setrecursionlimit(limit)
+    for name in parse_tables:
+        setattr(cfg, name, tables[name])
+    cfg.call_graph = None
+
+
 ########################################################################################
 #                                   EXPLORE CALLS                                      #
 ########################################################################################
+# call graph of the functions defined in the source, built from the FuncCallVisitor tables.
+# The traversals use explicit stacks, so deep and recursive call chains do not hit the Python
+# recursion limit. Calls to functions that are not defined in the source (libc, ...) are kept
+# in the adjacency index but are not part of closures
+class CallGraph:
+    def __init__(self, calls_table):
+        self.callees_table = OrderedDict()
+        self.callers_table = {}
+        for func, calls in calls_table.items():
+            self.callees_table[func] = list(OrderedDict.fromkeys(calls)) # unique, in call order
+        for func, callees in self.callees_table.items():
+            self.callers_table.setdefault(func, [])
+            for callee in callees:
+                self.callers_table.setdefault(callee, []).append(func)
+        self.closures = {}
+        self.scc_index = None
+        self.scc_reach = None
+        self.scc_members = None
+
+    def defined(self, func):
+        return func in self.callees_table
+
+    def callees(self, func):
+        return self.callees_table.get(func, [])
+
+    def callers(self, func):
+        return self.callers_table.get(func, [])
+
+    # defined functions reachable from func, callees before callers (post order), func last
+    def closure(self, func):
+        if func not in self.closures:
+            order = []
+            if func in self.callees_table:
+                visited = {func}
+                stack = [(func, iter(self.callees_table[func]))]
+                while stack:
+                    node, callees = stack[-1]
+                    for callee in callees:
+                        if callee in self.callees_table and callee not in visited:
+                            visited.add(callee)
+                            stack.append((callee, iter(self.callees_table[callee])))
+                            break
+                    else:
+                        stack.pop()
+                        order.append(node)
+            self.closures[func] = order
+        return self.closures[func]
+
+    # strongly connected components (mutually recursive functions), iterative Tarjan.
+    # Components come out callees first
+    def sccs(self):
+        index, low, on_stack, stack, components = {}, {}, set(), [], []
+        for root in self.callees_table:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.callees_table[root]))]
+            while work:
+                node, callees = work[-1]
+                for callee in callees:
+                    if callee not in self.callees_table:
+                        continue
+                    if callee not in index:
+                        index[callee] = low[callee] = len(index)
+                        stack.append(callee)
+                        on_stack.add(callee)
+                        work.append((callee, iter(self.callees_table[callee])))
+                        break
+                    if callee in on_stack:
+                        low[node] = min(low[node], index[callee])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component)
+        return components
+
+    # reachability of each component as a bitmask over the components, computed once
+    def build_reach(self):
+        components = self.sccs()
+        self.scc_members = components
+        self.scc_index = {func: i for i, component in enumerate(components) for func in component}
+        self.scc_reach = []
+        for i, component in enumerate(components): # callees first, their reach is already known
+            reach = 1 << i
+            for func in component:
+                for callee in self.callees_table[func]:
+                    if callee in self.scc_index and self.scc_index[callee] != i:
+                        reach |= self.scc_reach[self.scc_index[callee]]
+            self.scc_reach.append(reach)
+
+    def reachable(self, src, dst):
+        if self.scc_reach is None:
+            self.build_reach()
+        if src not in self.scc_index or dst not in self.scc_index:
+            return False
+        return bool(self.scc_reach[self.scc_index[src]] >> self.scc_index[dst] & 1)
+
+    # set of the defined functions reachable from func, func included
+    def reachable_from(self, func):
+        if self.scc_reach is None:
+            self.build_reach()
+        if func not in self.scc_index:
+            return set()
+        funcs, reach, i = set(), self.scc_reach[self.scc_index[func]], 0
+        while reach:
+            if reach & 1:
+                funcs.update(self.scc_members[i])
+            reach >>= 1
+            i += 1
+        return funcs
+
+    def recursive(self, func):
+        if self.scc_reach is None:
+            self.build_reach()
+        return len(self.scc_members[self.scc_index[func]]) > 1 or func in self.callees_table[func]
+
+
+def call_graph(cfg):
+    if cfg.call_graph is None:
+        cfg.call_graph = CallGraph(cfg.calls_table)
+    return cfg.call_graph
+
+
 def explore_calls(top, hierarchical_calls, cfg): # gets called with different top and hierarchical, hence cannot take those from cfg
-    for func in cfg.calls_table[top]:
-        if func in cfg.calls_table:
-            explore_calls(func, hierarchical_calls, cfg)
-        if func not in hierarchical_calls:
+    if cfg.index:
+        import_calls(top, cfg) # callees defined in the other files of the project
+    seen = set(hierarchical_calls)
+    for func in call_graph(cfg).closure(top):
+        if func not in seen:
+            seen.add(func)
             hierarchical_calls.append(func)
-    if top not in hierarchical_calls:
-        hierarchical_calls.append(top)
     return hierarchical_calls
 
 
 
 
 ########################################################################################
-#                                   FIX REPEATS                                        #
+#                                       SLICE                                          #
 ########################################################################################
-def fix_repeat(string):
-    # string be like [0x0, 0x1, 0x2, 0x3, 0x4, 0x5 <repeats 11 times>, 0x10, 0x11, 0x12, 0x13]
-    # we need to expand the repeat
-    if "repeat" not in string:
-        return string
-    item_to_fix = ""
-    fixed = ""
-    if "," not in string:
-        # string is {0x0 <repeats 64 times>}
-        to_expand = string[1:].split(" ")[0]+ " ,"
-        expanded = to_expand * int(string.split("repeats")[1].split("times>")[0])
-        fixed = "[" + expanded[:-1] + "]" # remove last comma
-        return fixed
-    for element in string.split(","):
-        if "repeats" in element:
-            item_to_fix = element
-            fixed += "{expanded}"
-        else:
-            fixed += element
-            fixed += ","
-    if "times>]" in item_to_fix:
-        # the repeat is at the end
-        to_expand = item_to_fix.split("<repeats")[0] + ","
-        times = int(item_to_fix.split("repeats")[1].split("times>")[0])
-        expanded = to_expand * times
-        fixed = fixed.format(expanded=expanded)
-        fixed = fixed[:-1]+"]"
-    else:
-        fixed = fixed[:-1]
-        to_expand = item_to_fix.split("<repeats")[0] + ","
-        if "[" in to_expand: # this is the first element
-            to_expand = to_expand[1:]
-            append ="["
+# the top level declarations of the source are rendered once, after parsing, into units_table
+# with the names each one defines and uses. The file of a function holds the #include lines of
+# the source and only the units it needs, transitively: its callees, the typedefs, struct
+# definitions, globals and prototypes they refer to, in source order. Declarations of the
+# headers are not units, they come with the #include lines, so the ast is not kept past parsing
+class UsesVisitor(c_ast.NodeVisitor):
+    # names a declaration refers to: identifiers, typedef names and struct, union and enum tags
+    def __init__(self):
+        self.uses = set()
+        self.tags = set() # tags and enumerators defined inside the declaration
+
+    def visit_ID(self, node):
+        self.uses.add(node.name)
+
+    def visit_IdentifierType(self, node):
+        self.uses.update(node.names)
+
+    def visit_StructRef(self, node):
+        self.visit(node.name) # the field is not a name of the file scope
+
+    def visit_Struct(self, node):
+        self.visit_tag("struct", node)
+
+    def visit_Union(self, node):
+        self.visit_tag("union", node)
+
+    def visit_Enum(self, node):
+        self.visit_tag("enum", node)
+
+    def visit_Enumerator(self, node):
+        self.tags.add(node.name)
+        self.generic_visit(node)
+
+    def visit_tag(self, kind, node):
+        if node.name is not None:
+            self.uses.add(f"{kind} {node.name}")
+            if getattr(node, "decls", getattr(node, "values", None)) is not None:
+                self.tags.add(f"{kind} {node.name}")
+        self.generic_visit(node)
+
+
+def source_units(ast, cfg):
+    # {"includes": #include lines of the source, "headers": files_digest of the headers they read,
+    #  "units": [unit], "defined": {name: [unit index]}}
+    from pycparser import c_generator
+    generator = c_generator.CGenerator()
+    with open(cfg.filename) as f:
+        includes = [line.strip() for line in f if re.match(r"\s*#\s*include\b", line)]
+    table = {"includes": includes, "headers": files_digest(source_dependencies(cfg.filename, cfg.cpp_args, cfg)[0][1:]), "units": [], "defined": {}}
+    for node in ast.ext:
+        decl = node.decl if isinstance(node, c_ast.FuncDef) else node
+        if decl.coord is None or os.path.basename(decl.coord.file) != os.path.basename(cfg.filename):
+            continue
+        v = UsesVisitor()
+        v.visit(node)
+        unit = {"name": getattr(decl, "name", None), "text": generator.visit(node) + ("" if isinstance(node, c_ast.FuncDef) else ";"),
+                "line": decl.coord.line, "column": decl.coord.column, "uses": sorted(v.uses)}
+        if isinstance(node, c_ast.FuncDef):
+            unit["kind"], defines = "function", [decl.name] # the tags in the body are local
+        elif isinstance(decl, c_ast.Decl) and isinstance(decl.type, c_ast.FuncDecl):
+            unit["kind"], defines = "prototype", [decl.name]
+        elif isinstance(decl, c_ast.Typedef) or (isinstance(decl, c_ast.Decl) and decl.name is None):
+            unit["kind"], defines = "type", [decl.name, *v.tags]
         else:
-            append = ""
-        times = int(item_to_fix.split("repeats")[1].split("times>")[0])
-        expanded = to_expand * times
-        fixed = fixed.format(expanded=expanded)
-        fixed = append + fixed
-    # print(fixed.format(expanded=expanded))
-    return fixed
+            unit["kind"], defines = "global", [decl.name, *v.tags]
+        if unit["kind"] in ("function", "prototype"):
+            prototype = copy.copy(decl)
+            prototype.storage = [storage for storage in decl.storage if storage != "static"]
+            prototype.funcspec = [spec for spec in decl.funcspec if spec != "inline"]
+            unit["prototype"] = generator.visit(prototype) + ";"
+            unit["static"] = "static" in decl.storage
+        for name in defines:
+            if name is not None:
+                table["defined"].setdefault(name, []).append(len(table["units"]))
+        table["units"].append(unit)
+    return table
+
+
+def slice_units(funcs, cfg, table=None):
+    # indices of the units needed by funcs, in source order. table is the units table of
+    # another file of the index, cfg.units_table by default
+    table = cfg.units_table if table is None else table
+    needed = set()
+    stack = list(funcs)
+    seen = set(stack)
+    while stack:
+        for i in table["defined"].get(stack.pop(), []):
+            if i not in needed:
+                needed.add(i)
+                for name in table["units"][i]["uses"]:
+                    if name not in seen:
+                        seen.add(name)
+                        stack.append(name)
+    return sorted(needed)
+
+
+def sliced_source(funcs, cfg):
+    # self contained source of funcs: the includes of the source and the units they need
+    units = cfg.units_table["units"]
+    return "\n".join(cfg.units_table["includes"] + [units[i]["text"] for i in slice_units(funcs, cfg)]) + "\n"
 
 
 ########################################################################################
-#                                  BUILD UNIT TEST                                     #
-#######################################################################################
-def build_unit_test(func, cfg):
-    print("Building unit test for ", func)
+#                                     PROCESSES                                        #
+########################################################################################
+# the compiler, gdb, the program and the tests run through run_process: their output is streamed
+# line by line to a log file, and to an optional callback, instead of being held in memory. Each
+# runs in its own process group, killed with everything it started (the program under gdb) when it
+# goes past its wall clock limit, when the resident memory of the group goes past memory_limit, or
+# when the run is interrupted. cancel_processes kills the ones still running (--serve shutdown)
+running_processes = set()
+running_lock = threading.Lock()
 
-    # compile the file with gcc
-    print(" ".join(["clang","-ggdb", "-g3", "-O0", "-fsanitize=address",cfg.filename, "-o", f"{cfg.tmp_folder}to_debug"]), flush=True)
-    p= Popen(["clang","-ggdb", "-g3", "-O0", "-fsanitize=address",cfg.filename, "-o", f"{cfg.tmp_folder}to_debug"])
-    p.wait()
-    # get param values
-    # build gdb script
-    pointers_table = OrderedDict() # associates a pointer to its characteristics 
+def process_rss(pid):
+    # resident memory of pid and of its descendants, in bytes
+    total = 0
+    stack = [pid]
+    while stack:
+        pid = stack.pop()
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * resource.getpagesize()
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            pass # exited in the meantime, or no /proc
+    return total
+
+
+def kill_process(p):
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def run_process(cmd, log, timeout=None, memory_limit=None, input=None, on_line=None, stdin=None, **kwargs):
+    # runs cmd to the end, returns {"returncode", "status": ok | timeout | memory, "tail": last lines of output}.
+    # timeout is in seconds and memory_limit in bytes, None or 0 for no limit. The standard input
+    # is the text input, the file stdin or nothing
+    tail = collections.deque(maxlen=50)
+    with open(log, "w") as f:
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE if input is not None else stdin or subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                  text=True, errors="replace", bufsize=1, start_new_session=True, **kwargs)
+        with running_lock:
+            running_processes.add(p)
+        def read():
+            for line in p.stdout:
+                f.write(line)
+                tail.append(line)
+                if on_line is not None:
+                    on_line(line)
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+        status = "ok"
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            if input is not None:
+                try:
+                    p.stdin.write(input)
+                    p.stdin.close()
+                except BrokenPipeError:
+                    pass
+            while True:
+                try:
+                    p.wait(0.1)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if deadline is not None and time.monotonic() > deadline:
+                    status = "timeout"
+                elif memory_limit and process_rss(p.pid) > memory_limit:
+                    status = "memory"
+                else:
+                    continue
+                kill_process(p)
+                p.wait()
+                break
+        finally:
+            if p.poll() is None:
+                kill_process(p) # interrupted
+                p.wait()
+            with running_lock:
+                running_processes.discard(p)
+            reader.join(1)
+    return {"returncode": p.returncode, "status": status, "tail": "".join(tail)}
+
+
+def cancel_processes():
+    with running_lock:
+        for p in running_processes:
+            kill_process(p)
 
-    if cfg.params_pointers_table[func]:
-        # we need to run gdb twice, first time to get the addresses and sizes of memory locations and second time to print those out
-        # get addresses
-        with open(f"{cfg.tmp_folder}" + func + "_gdb.py", "w") as f:
-            print("import gdb", file =f)
-            print(f"""gdb.execute("set print elements unlimited")""", file=f)
-            print(f"""gdb.execute("file {cfg.tmp_folder}to_debug")""", file=f)
-            print(f"""gdb.execute("break {func}")""", file =f)
-            print("""gdb.execute("run")""", file =f)
-
-            generator = c_generator.CGenerator()
-            for param in cfg.params_table[func]:
-                if isinstance(param[0], c_ast.PtrDecl) or isinstance(param[0], c_ast.ArrayDecl):
-                    print(f"""gdb.execute("p (void) __asan_describe_address({param[-1]})")""", file =f)
-                    ptr_type = generator.visit(param[0].type)
-                    if "[" in ptr_type:
-                        ptr_type = ptr_type.split("[")[0]
-                    print(f"""gdb.execute('printf "sizeof {param[-1]} %d\\\\n", sizeof({ptr_type})')""", file =f)
-                    pointers_table[param[-1]] = PointerData()
-            print("""gdb.execute("quit")""", file =f)
-
-        #run debug 
-        p = Popen(["gdb"], stdout=PIPE, stdin=PIPE, stderr=PIPE, bufsize=0, text=True)
-        stdout_data, stderr_data = p.communicate(input=f"\n\nsource {cfg.tmp_folder}{func}_gdb.py\n")
-        
-        with open(f"{cfg.tmp_folder}" + func + "_gdb_fsan.log", "w") as f:
-            dbg_out = stdout_data.replace(", \n", ",")
-            dbg_out += "STDERR\n"
-            dbg_out += stderr_data.replace(", \n", ",")
-            print(dbg_out, file=f) # this is just for debugging
-        print(cfg.params_table)
-        print(pointers_table)
-        keys_list = list(pointers_table.keys())
-        idx = 0 # tracks pointer number
-        for line in dbg_out.split("\n"):
-            
-            if "sizeof" in line: 
-                name = line.split(" ")[1]
-                type_size = int(line.split(" ")[2])
-                pointers_table[name].type_size = type_size
-            # 3 cases for offset size and base: local array global array dynamic array
-            elif "global variable" in line:
-                #print(line)
-                # 0x00000074bb80 is located 0 bytes inside of global variable 'array' defined in 'global.c' (0x74bb80) of size 80
-                offset = int(line.split("located ")[1].split(" bytes")[0])
-                size = int(line.split("of size ")[1])
-                base = int(line.split("defined in '")[1].split("'")[1].split("(")[1].split(")")[0], 16)
-                #print(offset, size, hex(base), idx)
-                pointers_table[keys_list[idx]].byte_offset = offset
-                pointers_table[keys_list[idx]].byte_size = size
-                pointers_table[keys_list[idx]].base = base
-                pointers_table[keys_list[idx]].element_offset = offset//pointers_table[keys_list[idx]].type_size
-                idx +=1
-            elif "region" in line:
-                #print(line)
-                # 0x507000000090 is located 0 bytes inside of 80-byte region [0x507000000090,0x5070000000e0)
-                offset = int(line.split("inside of ")[1].split("-byte")[0])
-                base = int(line.split("[")[1].split(",")[0], 16)
-                #print(offset, size, hex(base), idx)
-                pointers_table[keys_list[idx]].byte_offset = offset
-                pointers_table[keys_list[idx]].byte_size = size
-                pointers_table[keys_list[idx]].base = base
-                pointers_table[keys_list[idx]].element_offset = offset//pointers_table[keys_list[idx]].type_size
-                idx +=1
-            elif "Address " in line:
-                #print(line)
-                # Address 0x7ffff3f00048 is located in stack of thread T0 at offset 72 in frame
-                base = int(line.split("Address ")[1].split(" is")[0], 16)
-            elif "Memory access" in line: 
-                # print(line)
-                # print(idx)
-                # print(keys_list)
-                # print(pointers_table[keys_list[idx]].type_size)
-                # [32, 112) 'array3' (line 19) <== Memory access at offset 72 is inside this variable
-                # base is taken from elif above
-                # offset is given from frame pointer, have to shift it to our base
-                offset = (int(line.split("offset ")[1].split(" is")[0]) - int(line.split("[")[1].split(",")[0])) 
-                size = int(line.split("[")[1].split(",")[1].split(")")[0]) - int(line.split("[")[1].split(",")[0])
-                base = base - offset
-                # print(offset, size, hex(base), idx)
-                # print(keys_list)
-                pointers_table[keys_list[idx]].byte_offset = offset
-                pointers_table[keys_list[idx]].byte_size = size
-                pointers_table[keys_list[idx]].base = base
-                pointers_table[keys_list[idx]].element_offset = offset//pointers_table[keys_list[idx]].type_size
-                idx +=1
-            #else: print(line)
-    # get values
-    with open(f"{cfg.tmp_folder}" + func + "_gdb.py", "w") as f:
-        print("import gdb", file =f)
-        print(f"""gdb.execute("set print elements unlimited")""", file=f)
-        print(f"""gdb.execute("file {cfg.tmp_folder}to_debug")""", file=f)
-        print(f"""gdb.execute("break {func}")""", file =f)
-        print("""gdb.execute("run")""", file =f)
-        
+
+########################################################################################
+#                                   BUILD BINARY                                       #
+########################################################################################
+compiler = "clang"
+build_flags = ["-ggdb", "-g3", "-O0", "-fsanitize=address"]
+
+def files_digest(paths):
+    # hash of the paths and contents of files, a missing file counts as such
+    key = hashlib.sha256()
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                data = b"+" + f.read()
+        except OSError:
+            data = b"-"
+        key.update(path.encode() + b"\0" + data + b"\0")
+    return key.hexdigest()
+
+
+def source_dependencies(filename, args, cfg, cc="cpp"):
+    # (files, digest): the source and the headers the preprocessor of cc reads for it with args, through
+    # the include paths and -include, and the files_digest of them. System headers are left out (-MM),
+    # they are covered by the compiler identity. The list of the last run is kept in cache_folder/deps/
+    # and used while its files are unchanged, so a rerun on unchanged files does not run cc. As with
+    # make, a header added in front of the one found on the include path is only seen after a change
+    filename = os.path.realpath(filename)
+    record_path = f"{cfg.cache_folder}deps/{hashlib.sha256(json.dumps([cc, filename, *args]).encode()).hexdigest()[:32]}.json"
+    if os.path.exists(record_path):
+        with open(record_path) as f:
+            record = json.load(f)
+        digest = files_digest(record["files"])
+        if digest == record["digest"]:
+            return record["files"], digest
+    result = subprocess.run([cc, "-MM", *args, filename], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    if result.returncode != 0:
+        return [filename], files_digest([filename]) # not recorded, the error is reported by the preprocessing or the build
+    # "target.o: file header \ \n header", the spaces in the paths are escaped
+    text = result.stdout.replace("\\\n", " ").split(": ", 1)[-1]
+    files = [filename] + [os.path.realpath(path.replace("\\ ", " ")) for path in re.split(r"(?<!\\)\s+", text.strip())[1:]]
+    digest = files_digest(files)
+    os.makedirs(os.path.dirname(record_path), exist_ok=True)
+    tmp = f"{record_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"files": files, "digest": digest}, f)
+    os.replace(tmp, record_path)
+    return files, digest
+
+
+def linked_flags(cfg):
+    # include paths and cpp args of the files linked with the source
+    flags = []
+    for path, file_args in cfg.linked_files:
+        flags += ["-I", os.path.dirname(path), *file_args]
+    return flags
+
+
+def build_binary(cfg, filename=None, flags=build_flags, output="to_debug", origin=None):
+    # the instrumented binary is the same for every function, build it once per run.
+    # builds are cached in cache_folder/build_cache/<key>/ where the key covers the source, the headers
+    # it includes (see source_dependencies), the compiler identity and the flags, so repeated runs on an
+    # unchanged file do not call clang.
+    # filename is a rewrite of origin, cfg.filename by default (see capture_native), its local includes are looked up next to origin.
+    # Binaries also link the other files of the index the source needs (see linked_files), objects (-c) do not
+    cc = shutil.which(compiler) or compiler
+    origin = origin or cfg.filename
+    flags = [*flags, *cfg.cpp_args[1:]]
+    if filename is not None:
+        flags = [*flags, "-I", os.path.dirname(os.path.abspath(origin))]
+    sources = [] if "-c" in flags else [path for path, _ in cfg.linked_files]
+    if sources:
+        flags += linked_flags(cfg)
+    key = hashlib.sha256()
+    for path in [origin, *([filename] if filename is not None else []), *sources]:
+        key.update(source_dependencies(path, flags, cfg, cc)[1].encode() + b"\0")
+    filename = filename or origin
+    if os.path.exists(cc):
+        # identify the compiler by its resolved path, size and mtime instead of running clang --version
+        stat = os.stat(os.path.realpath(cc))
+        key.update(f"{os.path.realpath(cc)}:{stat.st_size}:{stat.st_mtime_ns}".encode() + b"\0")
+    key.update(" ".join(flags).encode())
+    build_dir = f"{cfg.cache_folder}build_cache/{key.hexdigest()[:16]}/"
+    binary = build_dir + output
+    if output == "to_debug":
+        cfg.binary = binary
+    if os.path.exists(binary):
+        print("Using cached build", binary, flush=True)
+        return binary
+
+    os.makedirs(build_dir, exist_ok=True)
+    cmd = [compiler, *flags, filename, *sources, "-o", binary + ".tmp"]
+    print(" ".join(cmd), flush=True)
+    with cfg.profiler.stage("build"):
+        result = run_process(cmd, binary + ".log", cfg.stage_timeout, cfg.memory_limit, on_line=lambda line: print(line, end="", flush=True))
+    if result["status"] != "ok":
+        raise RuntimeError(f"{compiler} killed building {filename} ({result['status']})")
+    if result["returncode"] != 0:
+        raise RuntimeError(f"{compiler} failed to build {filename}")
+    # only publish complete builds in the cache
+    os.replace(binary + ".tmp", binary)
+    return binary
+
+
+########################################################################################
+#                                      CAPTURE                                         #
+########################################################################################
+# hits sampled by the capture script, with invocations, stride and sampling of the driver. Apart
+# from the rest of the script so that it runs without gdb
+gdb_sampler_script = """class Sampler:
+    # decides which hits are captured and how many hits to ignore before the next stop
+    def __init__(self):
+        self.captured = 0
+        self.next = 1 # next hit to stop at
+        self.w = math.exp(math.log(1 - random.random()) / invocations)
+
+    def slot(self, hit):
+        # slot of this hit, None if it is not sampled
+        if hit != self.next:
+            return None
+        if self.captured < invocations:
+            self.captured += 1
+            return self.captured - 1
+        return random.randrange(invocations)
+
+    def skip(self, hit):
+        # hits to ignore before the next stop, None when done with this function
+        if sampling == "stride":
+            if self.captured == invocations:
+                return None
+            self.next = hit + stride
+        elif self.captured < invocations:
+            self.next = hit + 1
+        else:
+            # reservoir sampling, algorithm L: jump straight to the next replacement
+            self.next = hit + int(math.log(1 - random.random()) / math.log(1 - self.w)) + 1
+            self.w *= math.exp(math.log(1 - random.random()) / invocations)
+        return self.next - hit - 1
+"""
+
+# gdb side of the capture: breakpoints on all the functions at once, one run of the program.
+# At each stop the extents of the pointer parameters are resolved with __asan_locate_address
+# and every parameter is evaluated through the gdb python api and written as one json record
+# per line to the capture file. Pointer buffers are read in one bulk read and appended as raw bytes
+# to the data file, the record keeps their offset and size in it.
+# Up to invocations calls of each function are captured, sampled every stride calls or with a
+# reservoir over all the calls. The breakpoint ignore count skips the calls that are not sampled,
+# so gdb does not stop on them. A call record opens each captured call and its slot, a later call
+# sampled in the same slot replaces it.
+# The driver prepends binary, capture_path, data_path, invocations, stride, sampling, seed,
+# params = {func: [(name, is_pointer, element type)]}, graph_depth, graph_budget, the workload
+# (run_args, the arguments and stdin redirection of run, environment and cwd) and keep_alive,
+# set when the gdb session is reused by --serve and must not quit.
+# With graph_depth, the pointers stored inside the captured buffers are followed (see walk):
+# each object reached is located with asan and read once, object records list them and link
+# records the pointers between them, which the test patches after rebuilding the objects.
+# With checkpoint_at (--capture checkpoint), the program runs once up to the first call of that
+# function and is forked there with gdb checkpoint. Each function is then captured in its own pass
+# resumed from the checkpoint, the prefix of the program is not run again, and the hits of each
+# function are counted from the checkpoint
+gdb_capture_script = """
+import gdb
+import json
+import math
+import random
+import re
+import sys
+
+gdb.execute("set pagination off")
+gdb.execute("set confirm off")
+if gdb.selected_inferior().pid != 0: # left over by a failed capture of a warm session
+    gdb.execute("kill")
+gdb.execute("delete")
+gdb.execute("file " + binary)
+gdb.execute("cd " + cwd)
+for name in globals().get("applied_environment", {}): # set by the previous capture of a warm session
+    gdb.execute("unset environment " + name)
+for name, value in environment.items():
+    gdb.execute(f"set environment {name}={value}")
+applied_environment = environment
+out = open(capture_path, "w")
+data_out = open(data_path, "wb")
+
+scratch = None
+def locate(name):
+    # base, offset and size of the memory region the pointer points into
+    addr = int(gdb.parse_and_eval("(unsigned long) " + name))
+    base, size = locate_address(addr)
+    if base is None:
+        # unknown to asan, take the single pointed element
+        return addr, 0, int(gdb.parse_and_eval("sizeof(*%s)" % name))
+    return base, addr - base, size
+
+def locate_address(addr):
+    # base and size of the asan region of addr, None, None if asan does not know it
+    global scratch
+    if scratch is None:
+        scratch = int(gdb.parse_and_eval("(unsigned long) ((void *(*)(unsigned long)) malloc)(2 * sizeof(unsigned long))"))
+    gdb.parse_and_eval("(void) ((char *(*)(void *, char *, unsigned long, void **, unsigned long *)) __asan_locate_address)"
+                       "((void *) %d, (char *) 0, 0, (void **) %d, (unsigned long *) %d)" % (addr, scratch, scratch + 8))
+    base = int(gdb.parse_and_eval("*(unsigned long *) %d" % scratch))
+    size = int(gdb.parse_and_eval("*(unsigned long *) %d" % (scratch + 8)))
+    if base == 0 or not base <= addr < base + size:
+        return None, None
+    return base, size
+
+slots_cache = {}
+def pointer_slots(t):
+    # (byte offset, pointee type) of the pointers inside a value of gdb type t
+    t = t.strip_typedefs()
+    key = str(t)
+    if key not in slots_cache:
+        slots = []
+        if t.code == gdb.TYPE_CODE_PTR:
+            if t.target().strip_typedefs().code != gdb.TYPE_CODE_FUNC:
+                slots = [(0, t.target())]
+        elif t.code == gdb.TYPE_CODE_ARRAY and t.sizeof:
+            low, high = t.range()
+            if high - low < 64:
+                element = t.target()
+                slots = [(i * element.sizeof + offset, target) for i in range(high - low + 1) for offset, target in pointer_slots(element)]
+        elif t.code == gdb.TYPE_CODE_STRUCT:
+            for field in t.fields():
+                if not field.bitsize and hasattr(field, "bitpos"):
+                    slots += [(field.bitpos // 8 + offset, target) for offset, target in pointer_slots(field.type)]
+        slots_cache[key] = slots
+    return slots_cache[key]
+
+def walk(objects, links):
+    # follows the pointers inside the captured objects, breadth first, up to graph_depth
+    # levels and graph_budget bytes. objects are [base, size, type, first offset, depth, data]
+    budget = graph_budget
+    pointer_size = gdb.lookup_type("void").pointer().sizeof
+    i = 0
+    while i < len(objects):
+        base, size, t, first, depth, data = objects[i]
+        element_size = t.strip_typedefs().sizeof
+        slots = pointer_slots(t) if element_size else []
+        for element in range(first % element_size if slots else size, size - element_size + 1, element_size or 1):
+            for offset, target in slots:
+                if element + offset + pointer_size > size:
+                    continue
+                addr = int.from_bytes(bytes(data[element + offset:element + offset + pointer_size]), sys.byteorder)
+                if not addr:
+                    continue
+                found = next((j for j, obj in enumerate(objects) if obj[0] <= addr < obj[0] + max(obj[1], 1)), None)
+                if found is None and depth < graph_depth:
+                    new_base, new_size = locate_address(addr)
+                    if new_base is not None and new_size <= budget:
+                        try:
+                            new_data = gdb.selected_inferior().read_memory(new_base, new_size)
+                        except gdb.MemoryError:
+                            new_data = None
+                        if new_data is not None:
+                            budget -= new_size
+                            found = len(objects)
+                            objects.append([new_base, new_size, target, addr - new_base, depth + 1, new_data])
+                links.append((i, element + offset, found, addr - objects[found][0] if found is not None else 0))
+        i += 1
+
+def element(type_name):
+    # sizeof probe: size, signed, floating of the element type, None if it is not a scalar
+    try:
+        element_type = gdb.parse_and_eval("(%s) 0" % type_name).type.strip_typedefs()
+    except gdb.error:
+        return None
+    if element_type.code == gdb.TYPE_CODE_FLT:
+        return (element_type.sizeof, True, True) if element_type.sizeof in (4, 8) else None
+    if element_type.code in (gdb.TYPE_CODE_INT, gdb.TYPE_CODE_CHAR, gdb.TYPE_CODE_BOOL, gdb.TYPE_CODE_ENUM):
+        return element_type.sizeof, bool(gdb.parse_and_eval("(%s) -1 < 0" % type_name)), False
+    return None
+
+def to_json(value):
+    # int, float, list for arrays and {"fields": [[name, value], ...]} for structs
+    value_type = value.type.strip_typedefs()
+    if value_type.code in (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION):
+        return {"fields": [[field.name, to_json(value[field])] for field in value_type.fields()]}
+    if value_type.code == gdb.TYPE_CODE_ARRAY:
+        low, high = value_type.range()
+        return [to_json(value[i]) for i in range(low, high + 1)]
+    if value_type.code == gdb.TYPE_CODE_FLT:
+        return float(value)
+    return int(value)
+
+class PostCall(gdb.FinishBreakpoint):
+    # state after the call: the return value and the buffers of the pointer parameters again
+    def __init__(self, func, hit, slot, regions):
+        super().__init__(gdb.newest_frame(), internal=True)
+        self.func, self.hit, self.slot, self.regions = func, hit, slot, regions
+        finishing[0] += 1
+        pending_posts.append(self)
+
+    def stop(self):
+        value = None if self.return_value is None else to_json(self.return_value)
+        out.write(json.dumps({"func": self.func, "kind": "return", "hit": self.hit, "slot": self.slot, "value": value}) + "\\n")
+        for name, base, size in self.regions:
+            try:
+                data = gdb.selected_inferior().read_memory(base, size)
+            except gdb.MemoryError:
+                continue # freed by the call
+            out.write(json.dumps({"func": self.func, "kind": "post", "param": name, "hit": self.hit, "slot": self.slot,
+                                  "data": [data_out.tell(), size]}) + "\\n")
+            data_out.write(data)
+        data_out.flush()
+        out.flush()
+        finishing[0] -= 1
+        # stop only when nothing is left to capture, so that the driver kills the program
+        return not breakpoints and finishing[0] == 0
+
+    def out_of_scope(self):
+        finishing[0] -= 1 # left with longjmp or the program exited
+
+finishing = [0]
+pending_posts = []
+
+def capture(func, hit, slot):
+    # the call record marks the hit, also for functions without parameters
+    out.write(json.dumps({"func": func, "kind": "call", "hit": hit, "slot": slot}) + "\\n")
+    regions = []
+    objects = [] # the regions of the pointer parameters and, with graph_depth, what they point to
+    roots = []
+    for name, pointer, elem_type in params[func]:
+        record = {"func": func, "param": name, "slot": slot}
+        if pointer:
+            scalar = element(elem_type)
+            elem = scalar or (1, False, False)
+            try:
+                base, offset, size = locate(name)
+                data = gdb.selected_inferior().read_memory(base, size)
+                pointee = gdb.parse_and_eval(name).type.strip_typedefs()
+                pointee = pointee.target() if pointee.code in (gdb.TYPE_CODE_PTR, gdb.TYPE_CODE_ARRAY) else gdb.lookup_type("char")
+            except (gdb.error, gdb.MemoryError):
+                # null or unmapped pointer, recorded empty like in the native capture
+                base, offset, size, data = 0, 0, 0, b""
+            regions.append((name, base, size))
+            if base and not any(obj[0] == base for obj in objects):
+                objects.append([base, size, pointee, offset, 0, data])
+                roots.append(name)
+            record.update(kind="pointer", base=base, offset=offset, size=size, scalar=scalar is not None,
+                          elem_size=elem[0], signed=elem[1], floating=elem[2], data=[data_out.tell(), size])
+            data_out.write(data)
+        else:
+            try:
+                value = to_json(gdb.parse_and_eval(name))
+            except (gdb.error, gdb.MemoryError):
+                value = None # optimized out or unreadable
+            if isinstance(value, dict):
+                record.update(kind="struct", fields=value["fields"])
+            else:
+                record.update(kind="value", value=value)
+        out.write(json.dumps(record) + "\\n")
+    if graph_depth and objects:
+        links = []
+        walk(objects, links)
+        for i, (base, size, _, _, _, data) in enumerate(objects):
+            record = {"func": func, "kind": "object", "slot": slot, "id": i, "base": base, "size": size}
+            if i < len(roots):
+                record["param"] = roots[i] # same bytes as the parameter
+            else:
+                record["data"] = [data_out.tell(), size]
+                data_out.write(data)
+            out.write(json.dumps(record) + "\\n")
+        for source, offset, target, target_offset in links:
+            out.write(json.dumps({"func": func, "kind": "link", "slot": slot, "source": source, "offset": offset,
+                                  "target": target, "target_offset": target_offset}) + "\\n")
+    data_out.flush()
+    out.flush()
+    try:
+        PostCall(func, hit, slot, regions)
+    except (gdb.error, ValueError):
+        pass # no caller frame to return to
+
+""" + gdb_sampler_script + """
+if "exited" not in globals(): # connected once per gdb session, a warm one sources the script for each capture
+    exited = [False]
+    gdb.events.exited.connect(lambda event: exited.__setitem__(0, True))
+exited[0] = False
+
+def run_captures(hit_offset=0):
+    # captures until the functions of breakpoints are done or the program exits.
+    # hit_offset counts the stop the pass starts at, the checkpoint is taken at a breakpoint
+    while (breakpoints or finishing[0]) and gdb.selected_inferior().pid != 0 and not exited[0]:
+        func = gdb.selected_frame().name()
+        if func in breakpoints:
+            hit = breakpoints[func].hit_count + (hit_offset if func == checkpoint_at else 0) # ignored hits are counted too
+            slot = samplers[func].slot(hit)
+            if slot is not None:
+                capture(func, hit, slot)
+            skip = samplers[func].skip(hit)
+            if skip is None:
+                breakpoints.pop(func).delete()
+            else:
+                breakpoints[func].ignore_count = skip
+        if breakpoints or finishing[0]:
+            gdb.execute("continue")
+
+def checkpoints():
+    # {id: pid} of the forks of the program and the id of the current one
+    forks, current = {}, None
+    for line in gdb.execute("info checkpoints", to_string=True).split("\\n"):
+        match = re.match(r"\\s*(\\*?)\\s*(\\d+)\\s+process\\s+(\\d+)", line)
+        if match:
+            forks[int(match.group(2))] = int(match.group(3))
+            if match.group(1):
+                current = int(match.group(2))
+    return forks, current
+
+random.seed(seed)
+samplers = {func: Sampler() for func in params}
+breakpoints = {}
+if checkpoint_at is None:
+    breakpoints.update({func: gdb.Breakpoint(func) for func in params})
+    gdb.execute("run" + run_args)
+    run_captures()
+else:
+    start = gdb.Breakpoint(checkpoint_at, internal=True)
+    gdb.execute("run" + run_args)
+    start.delete()
+    pristine = None
+    if gdb.selected_inferior().pid != 0 and not exited[0]:
+        pristine = int(re.search(r"checkpoint (\\d+)", gdb.execute("checkpoint", to_string=True)).group(1))
+    for i, func in enumerate(params if pristine is not None else []):
+        if i:
+            # the first pass runs in the process the checkpoint was taken from
+            forks, current = checkpoints()
+            if current != pristine:
+                try:
+                    gdb.execute(f"restart {pristine}")
+                    if current in forks:
+                        gdb.execute(f"delete checkpoint {current}") # the stopped process of the previous pass
+                except gdb.error:
+                    pass # left as it is, killed with the others at the end
+            scratch = None # malloc'd by the previous pass, after the checkpoint
+            # the checkpoint runs from here, a new one keeps the state for the next pass
+            pristine = int(re.search(r"checkpoint (\\d+)", gdb.execute("checkpoint", to_string=True)).group(1))
+        exited[0] = False
+        finishing[0] = 0
+        breakpoints[func] = gdb.Breakpoint(func)
+        run_captures(hit_offset=1)
+        for bp in list(breakpoints.values()) + [post for post in pending_posts if post.is_valid()]:
+            bp.delete()
+        breakpoints.clear()
+        del pending_posts[:]
+        out.flush()
+if gdb.selected_inferior().pid != 0:
+    gdb.execute("kill") # with checkpoints, all the forks
+out.close()
+data_out.close()
+if keep_alive:
+    for bp in breakpoints.values():
+        bp.delete()
+else:
+    gdb.execute("quit")
+"""
+
+def capture(funcs, cfg, name, folder=None, workload=None, checkpoint=False):
+    # runs one gdb session capturing all funcs, returns {func: [{param: record}]}, one entry per captured call.
+    # scripts, logs and capture files go to folder, tmp_folder by default, named after name. The program runs
+    # with the arguments, stdin, environment and cwd of workload (see load_workloads), with none by default.
+    # With checkpoint (--capture checkpoint) the passes resume from a checkpoint at the first call of top
+    folder = folder or cfg.tmp_folder
+    workload = workload or {}
+    run_args = "".join(" " + shlex.quote(arg) for arg in workload.get("args", []))
+    if workload.get("stdin"):
+        run_args += " < " + shlex.quote(workload["stdin"])
+    params = {}
+    for func in funcs:
+        params[func] = []
         for param in cfg.params_table[func]:
             if isinstance(param[0], c_ast.PtrDecl) or isinstance(param[0], c_ast.ArrayDecl):
-                print(f"""gdb.execute("p/x *({pointers_table[param[-1]].base})@{pointers_table[param[-1]].byte_size//4}")""", file =f) ## print 4 bytes at a time
+                params[func].append((param[-1], True, " ".join(element_type(param[0], cfg))))
             else:
-                print(f"""gdb.execute("p/x {param[-1]}")""", file =f)
+                params[func].append((param[-1], False, None))
+    capture_path = f"{folder}{name}_capture.jsonl"
+    data_path = f"{folder}{name}_capture.bin"
+    script = f"{folder}{name}_gdb.py"
+    with open(script, "w") as f:
+        # absolute, gdb runs the program in the cwd of the workload
+        print(f"binary = {os.path.abspath(cfg.binary)!r}", file=f)
+        print(f"capture_path = {os.path.abspath(capture_path)!r}", file=f)
+        print(f"data_path = {os.path.abspath(data_path)!r}", file=f)
+        print(f"invocations = {cfg.invocations!r}", file=f)
+        print(f"stride = {cfg.stride!r}", file=f)
+        print(f"sampling = {cfg.sampling!r}", file=f)
+        print(f"seed = {cfg.seed!r}", file=f)
+        print(f"params = {params!r}", file=f)
+        print(f"graph_depth = {cfg.graph_depth!r}", file=f)
+        print(f"graph_budget = {cfg.graph_budget!r}", file=f)
+        print(f"checkpoint_at = {cfg.top if checkpoint else None!r}", file=f)
+        print(f"run_args = {run_args!r}", file=f)
+        print(f"environment = {workload.get('env', {})!r}", file=f)
+        print(f"cwd = {workload.get('cwd') or os.getcwd()!r}", file=f)
+        pool = cfg.gdb_pool if cfg.gdb_pool is not None and cfg.gdb_pool.owner == os.getpid() else None
+        print(f"keep_alive = {pool is not None!r}", file=f)
+        print(gdb_capture_script, file=f)
 
-        print("""gdb.execute("quit")""", file =f)
     # run debug
-    p = Popen(["gdb"], stdout=PIPE, stdin=PIPE, stderr=PIPE, bufsize=0, text=True)
-    stdout_data, stderr_data = p.communicate(input=f"\n\nsource {cfg.tmp_folder}{func}_gdb.py\n")
-    
-    with open(f"{cfg.tmp_folder}" + func + "_gdb.log", "w") as f:
-        dbg_out = stdout_data.replace(", \n", ",")
-        print(dbg_out, file=f) # this is just for debugging but info form fsan is in stderr
+    with cfg.profiler.stage("gdb", name):
+        if pool is not None:
+            # warm gdb of --serve, forked workers start their own
+            status = pool.run(os.path.abspath(script), f"{folder}{name}_gdb.log", cfg.stage_timeout, cfg.memory_limit)
+        else:
+            status = run_process(["gdb"], f"{folder}{name}_gdb.log", cfg.stage_timeout, cfg.memory_limit,
+                                 input=f"\n\nsource {os.path.abspath(script)}\n")["status"]
+    if status != "ok":
+        # the records are flushed after each call, the calls captured so far are kept
+        print(f"gdb killed capturing {name} ({status}), see {folder}{name}_gdb.log")
+
+    with cfg.profiler.stage("load", name):
+        return load_capture(capture_path, data_path, funcs)
+
+
+def load_capture(capture_path, data_path, funcs):
+    slots = {}
+    if os.path.exists(capture_path):
+        data = b""
+        if os.path.exists(data_path):
+            with open(data_path, "rb") as f:
+                data = memoryview(f.read())
+        hits = {}
+        with open(capture_path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record["kind"] == "call":
+                    # a new call in this slot replaces the previous one
+                    slots.setdefault(record["func"], {})[record["slot"]] = {}
+                    hits[record["func"], record["slot"]] = record["hit"]
+                    continue
+                if record["kind"] in ("object", "link"):
+                    graph = slots[record["func"]][record["slot"]].setdefault("graph", {"kind": "graph", "objects": [], "links": []})
+                    if record["kind"] == "link":
+                        graph["links"].append((record["source"], record["offset"], record["target"], record["target_offset"]))
+                    else:
+                        if "data" in record:
+                            offset, size = record["data"]
+                            record["data"] = data[offset:offset + size]
+                        graph["objects"].append(record)
+                    continue
+                if record["kind"] in ("return", "post"):
+                    # state after the call, only if the call was not replaced in the meantime
+                    if hits.get((record["func"], record["slot"])) != record["hit"]:
+                        continue
+                    params = slots[record["func"]][record["slot"]]
+                    if record["kind"] == "return":
+                        params["return"] = record
+                    elif record["param"] in params:
+                        offset, size = record["data"]
+                        params[record["param"]]["post"] = data[offset:offset + size]
+                    continue
+                if record["kind"] == "pointer":
+                    # raw bytes of the buffer, a view into the data file
+                    offset, size = record["data"]
+                    record["data"] = data[offset:offset + size]
+                slots[record["func"]][record["slot"]][record["param"]] = record
+    return distinct_invocations(slots, funcs)
+
+
+def invocation_hash(params):
+    # content hash of the inputs of a call, addresses are left out
+    key = hashlib.sha1()
+    for name in sorted(params):
+        record = params[name]
+        if record["kind"] == "return":
+            continue
+        if record["kind"] == "graph":
+            # the objects reached through the parameters and where their pointers point
+            for obj in record["objects"]:
+                key.update(f"object:{obj.get('param')}:{obj['size']}:".encode())
+                key.update(obj.get("data", b""))
+            key.update(json.dumps(record["links"]).encode())
+            continue
+        if record["kind"] == "pointer":
+            key.update(f"{name}:{record['offset']}:{record['size']}:".encode())
+            key.update(record["data"])
+        else:
+            key.update(f"{name}:{json.dumps(record.get('value', record.get('fields')))}".encode())
+    return key.hexdigest()
+
+
+def distinct_invocations(slots, funcs):
+    # {func: {slot: params}} to {func: [params]} in slot order, without calls with the same inputs
+    captures = {}
+    for func in funcs:
+        if func not in slots:
+            print("No capture for", func, "(never reached)")
+            continue
+        seen = set()
+        captures[func] = []
+        for slot in sorted(slots[func]):
+            digest = invocation_hash(slots[func][slot])
+            if digest not in seen:
+                seen.add(digest)
+                captures[func].append(slots[func][slot])
+    return captures
+
+
+########################################################################################
+#                                   NATIVE CAPTURE                                     #
+########################################################################################
+# capture without gdb: the entry of each function is rewritten to serialize its arguments
+# to a binary trace, the rewritten source is compiled once with asan and run natively.
+# Pointer extents come from __asan_locate_address like in the gdb script.
+# Trace records, all integers are 8 bytes in native order:
+#   C func slot hit                                         call, starts the records of a function
+#   P param base offset size elem_size kind <size bytes>    pointer parameter
+#   V param size leaves <size bytes> (offset elem_size count kind) * leaves   value parameter
+#   E                                                       end of the call
+#   R func slot hit regions (param size <size bytes>) * regions kind size <size bytes>
+#                                                           pointer buffers and return value after the call,
+#                                                           size 0 when the return value was not recorded
+#   O id param base size [<size bytes>]                     object of the pointer graph, the bytes only
+#                                                           when it is not the buffer of parameter param
+#   L source offset target target_offset                    pointer at offset in object source, target ~0
+#                                                           when it was not followed
+# kind: bit 0 scalar, bit 1 signed, bit 2 floating
+# Calls are sampled like in the gdb script, the reservoir uses algorithm R since a native call is cheap.
+# The state after the call is written by the cleanup function of a variable declared by the prologue,
+# which runs when the function returns. The frames of the captured calls remember their buffers.
+# Scalar return values go through __utg_retval: every return e; is rewritten to
+# return (__utg_retval = (e)); and the frame remembers where it is.
+# The pointer graph is walked by __utg_walk like walk in the gdb script, with the offsets of the
+# pointers inside each type taken from the ast (graph_types) and appended to the source as __utg_types
+native_flags = ["-g", "-O1", "-fsanitize=address"]
+
+native_runtime = """
+#include <stdio.h>
+#include <stdlib.h>
+#include <stddef.h>
+#include <sanitizer/asan_interface.h>
+#define __UTG_KIND(e) _Generic((e), char: 1 | (((char) -1 < 0) << 1), signed char: 3, short: 3, int: 3, long: 3, long long: 3, \\
+    unsigned char: 1, unsigned short: 1, unsigned int: 1, unsigned long: 1, unsigned long long: 1, _Bool: 1, float: 5, double: 5, default: 0)
+static FILE *__utg_trace;
+static unsigned long long __utg_hits[{n_funcs}];
+static unsigned long long __utg_captured[{n_funcs}];
+static struct {{
+    unsigned long long func, slot, hit, regions, ret_size, ret_kind;
+    struct {{ unsigned long long param; const void *base; size_t size; }} region[32];
+    const void *ret;
+}} __utg_frames[256];
+static unsigned long long __utg_depth;
+struct __utg_slot {{ unsigned long long offset, type; }};
+struct __utg_type {{ unsigned long long size, n_slots; const struct __utg_slot *slots; }};
+extern const struct __utg_type __utg_types[];
+static struct {{ const char *base; unsigned long long size, type, first, depth; }} __utg_objects[4096];
+static unsigned long long __utg_n_objects;
+static long long __utg_object(const void *ptr) {{
+    unsigned long long i;
+    for (i = 0; i < __utg_n_objects; i++)
+        if ((const char *) ptr >= __utg_objects[i].base && (const char *) ptr < __utg_objects[i].base + (__utg_objects[i].size ? __utg_objects[i].size : 1))
+            return i;
+    return -1;
+}}
+static int __utg_locate(const void *ptr, void **base, size_t *size) {{
+    *base = 0;
+    *size = 0;
+    if (ptr) __asan_locate_address((void *) ptr, 0, 0, base, size);
+    if (!*base || (const char *) ptr < (const char *) *base || (const char *) ptr >= (const char *) *base + *size) return 0;
+    const char *poisoned = __asan_region_is_poisoned(*base, *size);
+    if (poisoned) *size = poisoned - (const char *) *base;
+    return 1;
+}}
+static void __utg_u64(unsigned long long value) {{ fwrite(&value, 8, 1, __utg_trace); }}
+static void __utg_walk(void) {{
+    unsigned long long i, element, s, budget = {graph_budget};
+    for (i = 0; i < __utg_n_objects; i++) {{
+        const struct __utg_type *t = &__utg_types[__utg_objects[i].type];
+        if (!t->n_slots || !t->size) continue;
+        for (element = __utg_objects[i].first % t->size; element + t->size <= __utg_objects[i].size; element += t->size) {{
+            for (s = 0; s < t->n_slots; s++) {{
+                const void *ptr;
+                long long target;
+                void *base;
+                size_t size;
+                if (element + t->slots[s].offset + sizeof(void *) > __utg_objects[i].size) continue;
+                __builtin_memcpy(&ptr, __utg_objects[i].base + element + t->slots[s].offset, sizeof(void *));
+                if (!ptr) continue;
+                target = __utg_object(ptr);
+                if (target < 0 && __utg_objects[i].depth < {graph_depth} && __utg_n_objects < 4096
+                        && __utg_locate(ptr, &base, &size) && size <= budget) {{
+                    budget -= size;
+                    target = __utg_n_objects++;
+                    __utg_objects[target].base = base;
+                    __utg_objects[target].size = size;
+                    __utg_objects[target].type = t->slots[s].type;
+                    __utg_objects[target].first = (const char *) ptr - (const char *) base;
+                    __utg_objects[target].depth = __utg_objects[i].depth + 1;
+                    fputc('O', __utg_trace); __utg_u64(target); __utg_u64(~0ULL); __utg_u64((unsigned long long) base); __utg_u64(size);
+                    fwrite(base, 1, size, __utg_trace);
+                }}
+                fputc('L', __utg_trace); __utg_u64(i); __utg_u64(element + t->slots[s].offset);
+                __utg_u64(target < 0 ? ~0ULL : (unsigned long long) target);
+                __utg_u64(target < 0 ? 0 : (unsigned long long) ((const char *) ptr - __utg_objects[target].base));
+            }}
+        }}
+    }}
+}}
+static int __utg_call(unsigned long long func) {{
+    unsigned long long hit = ++__utg_hits[func], slot;
+    if (__utg_captured[func] < {invocations} && (hit - 1) % {stride} == 0) {{
+        slot = __utg_captured[func];
+    }} else if ({reservoir} && __utg_captured[func] == {invocations}) {{
+        slot = (((unsigned long long) rand() << 31) ^ (unsigned long long) rand()) % hit;
+        if (slot >= {invocations}) return 0;
+    }} else {{
+        return 0;
+    }}
+    if (!__utg_trace) {{
+        const char *path = getenv("UTG_TRACE");
+        __utg_trace = fopen(path ? path : "utg_trace.bin", "wb");
+        if (!__utg_trace) return 0;
+    }}
+    if (slot == __utg_captured[func]) __utg_captured[func]++;
+    fputc('C', __utg_trace); __utg_u64(func); __utg_u64(slot); __utg_u64(hit);
+    __utg_n_objects = 0;
+    if (__utg_depth < 256) {{
+        __utg_frames[__utg_depth].func = func;
+        __utg_frames[__utg_depth].slot = slot;
+        __utg_frames[__utg_depth].hit = hit;
+        __utg_frames[__utg_depth].regions = 0;
+        __utg_frames[__utg_depth].ret_size = 0;
+    }}
+    return ++__utg_depth;
+}}
+static void __utg_return(unsigned long long *frame) {{
+    unsigned long long i;
+    if (!*frame) return;
+    if (*frame <= 256) {{
+        fputc('R', __utg_trace); __utg_u64(__utg_frames[*frame - 1].func); __utg_u64(__utg_frames[*frame - 1].slot);
+        __utg_u64(__utg_frames[*frame - 1].hit); __utg_u64(__utg_frames[*frame - 1].regions);
+        for (i = 0; i < __utg_frames[*frame - 1].regions; i++) {{
+            __utg_u64(__utg_frames[*frame - 1].region[i].param); __utg_u64(__utg_frames[*frame - 1].region[i].size);
+            fwrite(__utg_frames[*frame - 1].region[i].base, 1, __utg_frames[*frame - 1].region[i].size, __utg_trace);
+        }}
+        __utg_u64(__utg_frames[*frame - 1].ret_kind); __utg_u64(__utg_frames[*frame - 1].ret_size);
+        fwrite(__utg_frames[*frame - 1].ret, 1, __utg_frames[*frame - 1].ret_size, __utg_trace);
+        fflush(__utg_trace);
+    }}
+    __utg_depth--;
+}}
+static void __utg_result(const void *ret, size_t size, unsigned long long kind) {{
+    if (__utg_depth <= 256) {{
+        __utg_frames[__utg_depth - 1].ret = ret;
+        __utg_frames[__utg_depth - 1].ret_size = size;
+        __utg_frames[__utg_depth - 1].ret_kind = kind;
+    }}
+}}
+static void __utg_pointer(unsigned long long param, const void *ptr, size_t fallback_size, size_t elem_size, unsigned long long kind, unsigned long long type) {{
+    void *base;
+    size_t size;
+    unsigned long long i;
+    if (!__utg_locate(ptr, &base, &size)) {{
+        // unknown to asan, take the single pointed element
+        const char *poisoned;
+        base = (void *) ptr;
+        size = ptr ? fallback_size : 0;
+        poisoned = __asan_region_is_poisoned(base, size);
+        if (poisoned) size = poisoned - (const char *) base;
+    }}
+    if (__utg_depth <= 256 && __utg_frames[__utg_depth - 1].regions < 32) {{
+        i = __utg_frames[__utg_depth - 1].regions++;
+        __utg_frames[__utg_depth - 1].region[i].param = param;
+        __utg_frames[__utg_depth - 1].region[i].base = base;
+        __utg_frames[__utg_depth - 1].region[i].size = size;
+    }}
+    fputc('P', __utg_trace); __utg_u64(param); __utg_u64((unsigned long long) base);
+    __utg_u64((const char *) ptr - (const char *) base); __utg_u64(size); __utg_u64(elem_size); __utg_u64(kind);
+    fwrite(base, 1, size, __utg_trace);
+    if ({graph_depth} && ptr && __utg_object(base) < 0 && __utg_n_objects < 4096) {{
+        __utg_objects[__utg_n_objects].base = base;
+        __utg_objects[__utg_n_objects].size = size;
+        __utg_objects[__utg_n_objects].type = type;
+        __utg_objects[__utg_n_objects].first = (const char *) ptr - (const char *) base;
+        __utg_objects[__utg_n_objects].depth = 0;
+        fputc('O', __utg_trace); __utg_u64(__utg_n_objects); __utg_u64(param); __utg_u64((unsigned long long) base); __utg_u64(size);
+        __utg_n_objects++;
+    }}
+}}
+static void __utg_value(unsigned long long param, const void *value, size_t size, unsigned long long leaves) {{
+    fputc('V', __utg_trace); __utg_u64(param); __utg_u64(size); __utg_u64(leaves);
+    fwrite(value, 1, size, __utg_trace);
+}}
+static void __utg_leaf(unsigned long long offset, size_t elem_size, size_t count, unsigned long long kind) {{
+    __utg_u64(offset); __utg_u64(elem_size); __utg_u64(count); __utg_u64(kind);
+}}
+static void __utg_end(void) {{
+    if ({graph_depth}) __utg_walk();
+    fputc('E', __utg_trace);
+    fflush(__utg_trace);
+}}
+#line 1 "{filename}"
+"""
+
+def resolve_type(t, cfg):
+    # follows typedefs: TypeDecl of a typedef name -> the typedef'd type
+    while isinstance(t, c_ast.TypeDecl) and isinstance(t.type, c_ast.IdentifierType) \
+            and len(t.type.names) == 1 and t.type.names[0] in cfg.typedefs_table:
+        t = cfg.typedefs_table[t.type.names[0]]
+    return t
+
+
+def layout(t, expr, cfg):
+    # how to serialize a value of type t found at the c expression expr, a tree of
+    # ("scalar", expr) | ("array", expr, element expr) | ("bytes", expr) | ("struct", [(field, tree)])
+    t = resolve_type(t, cfg)
+    if isinstance(t, c_ast.TypeDecl) and isinstance(t.type, c_ast.Struct):
+        decls = t.type.decls if t.type.decls is not None else cfg.struct_decls.get(t.type.name)
+        if not decls or any(decl.bitsize is not None or decl.name is None for decl in decls):
+            return ("bytes", expr) # unknown layout, bitfields or anonymous members
+        return ("struct", [(decl.name, layout(decl.type, c_ast.StructRef(expr, ".", c_ast.ID(decl.name)), cfg)) for decl in decls])
+    if isinstance(t, c_ast.ArrayDecl):
+        element = expr
+        while isinstance(t, c_ast.ArrayDecl):
+            element = c_ast.ArrayRef(element, c_ast.Constant("int", "0"))
+            t = resolve_type(t.type, cfg)
+        if isinstance(t, c_ast.TypeDecl) and isinstance(t.type, c_ast.IdentifierType):
+            return ("array", expr, element)
+        return ("bytes", expr)
+    if isinstance(t, c_ast.TypeDecl) and isinstance(t.type, c_ast.Union):
+        return ("bytes", expr)
+    return ("scalar", expr)
+
+
+def leaves(tree):
+    # leaves of a layout tree in serialization order
+    if tree[0] == "struct":
+        return [leaf for _, field in tree[1] for leaf in leaves(field)]
+    return [tree]
+
+
+def type_name(names):
+    return c_ast.Typename(None, [], None, c_ast.TypeDecl(None, [], None, c_ast.IdentifierType(names)))
+
+
+def c_name(t):
+    # c name of the type t, None if it contains an unnamed struct, union or enum
+    t = copy.deepcopy(t)
+    node = t
+    while not isinstance(node, c_ast.TypeDecl):
+        if not isinstance(node, (c_ast.PtrDecl, c_ast.ArrayDecl)):
+            return None
+        node = node.type
+    node.declname = None
+    if isinstance(node.type, (c_ast.Struct, c_ast.Union, c_ast.Enum)):
+        if node.type.name is None:
+            return None
+        node.type = type(node.type)(node.type.name, None) # drop the members
+    from pycparser import c_generator
+    return c_generator.CGenerator().visit(c_ast.Typename(None, [], None, t))
+
+
+def graph_slots(t, cfg, designator=""):
+    # (designator, pointee type) of the pointers inside a value of type t, the designator is the
+    # c suffix that reaches the pointer from the value, like .next or [2].name
+    t = resolve_type(t, cfg)
+    if isinstance(t, c_ast.PtrDecl):
+        return [] if isinstance(t.type, c_ast.FuncDecl) else [(designator, t.type)]
+    if isinstance(t, c_ast.ArrayDecl):
+        try:
+            dim = int(t.dim.value.rstrip("uUlL"), 0) if isinstance(t.dim, c_ast.Constant) else 0
+        except ValueError:
+            dim = 0
+        if dim > 64:
+            return [] # large arrays of pointers are not followed
+        return [slot for k in range(dim) for slot in graph_slots(t.type, cfg, f"{designator}[{k}]")]
+    if isinstance(t, c_ast.TypeDecl) and isinstance(t.type, c_ast.Struct):
+        decls = t.type.decls if t.type.decls is not None else cfg.struct_decls.get(t.type.name)
+        return [slot for decl in decls or [] if decl.bitsize is None and decl.name is not None
+                for slot in graph_slots(decl.type, cfg, f"{designator}.{decl.name}")]
+    return []
+
+
+def graph_type(t, cfg, types):
+    # index in __utg_types of the pointee type t, types maps the c name of each type to the name of
+    # a pointer to it and its slots. 0 is the type whose pointers are not followed: void, scalars,
+    # functions, unions, unnamed and incomplete types
+    resolved = resolve_type(t, cfg)
+    if isinstance(resolved, c_ast.TypeDecl) and isinstance(resolved.type, c_ast.Struct):
+        if resolved.type.decls is None and resolved.type.name not in cfg.struct_decls:
+            return 0
+    elif not isinstance(resolved, (c_ast.PtrDecl, c_ast.ArrayDecl)):
+        return 0
+    name = c_name(t)
+    if name is None or not graph_slots(t, cfg):
+        return 0
+    if name not in types:
+        types[name] = None # recursive types point to themselves
+        types[name] = (c_name(c_ast.PtrDecl([], t)), [(designator, graph_type(target, cfg, types)) for designator, target in graph_slots(t, cfg)])
+    return list(types).index(name) + 1
+
+
+def graph_table(types):
+    # __utg_types, the layouts of the types of graph_type
+    lines = []
+    entries = ["{1, 0, 0}"]
+    for i, (name, (pointer, slots)) in enumerate(types.items(), 1):
+        offsets = ", ".join(f"{{(unsigned long long) &(*({pointer}) 0){designator}, {target}}}" for designator, target in slots)
+        lines.append(f"static const struct __utg_slot __utg_slots_{i}[] = {{{offsets}}};")
+        entries.append(f"{{sizeof({name}), {len(slots)}, __utg_slots_{i}}}")
+    lines.append(f"const struct __utg_type __utg_types[] = {{{', '.join(entries)}}};")
+    return "\n".join(lines)
+
+
+class ReturnVisitor(c_ast.NodeVisitor):
+    # return statements of a function body
+    def __init__(self):
+        self.returns = []
+
+    def visit_Return(self, node):
+        self.returns.append(node)
+        self.generic_visit(node)
+
+
+def statement_end(lines, line, column):
+    # line and column of the ; ending the statement that starts at line, column,
+    # outside of parentheses, string and char literals and comments
+    depth, quote, comment = 0, None, None
+    while line < len(lines):
+        text = lines[line]
+        while column < len(text):
+            c = text[column]
+            if comment:
+                if comment == "*" and text.startswith("*/", column):
+                    comment, column = None, column + 1
+            elif quote:
+                if c == "\\":
+                    column += 1
+                elif c == quote:
+                    quote = None
+            elif text.startswith("//", column):
+                break
+            elif text.startswith("/*", column):
+                comment, column = "*", column + 1
+            elif c in "\"'":
+                quote = c
+            elif c in "([{":
+                depth += 1
+            elif c in ")]}":
+                depth -= 1
+            elif c == ";" and depth == 0:
+                return line, column
+            column += 1
+        line, column = line + 1, 0
+    return None
+
+
+def return_edits(func, cfg, lines):
+    # edits rewriting each return e; of func to return (__utg_retval = (e));
+    # None when the return value is not a scalar or a return cannot be rewritten
+    ret = resolve_type(cfg.nodes_table[func].decl.type.type, cfg)
+    if not isinstance(ret, c_ast.TypeDecl) or not isinstance(ret.type, c_ast.IdentifierType) or ret.type.names == ["void"]:
+        return None
+    visitor = ReturnVisitor()
+    visitor.visit(cfg.nodes_table[func].body)
+    edits = []
+    for node in visitor.returns:
+        if node.expr is None or node.coord is None or os.path.basename(node.coord.file) != os.path.basename(cfg.filename):
+            return None
+        line, column = node.coord.line - 1, max((node.coord.column or 1) - 1, 0)
+        if not lines[line].startswith("return", column):
+            return None # from a macro
+        end = statement_end(lines, line, column + len("return"))
+        if end is None:
+            return None
+        edits.append((line, column + len("return"), " (__utg_retval = ("))
+        edits.append((end[0], end[1], "))"))
+    return edits
+
+
+def native_prologue(func, idx, cfg, layouts, types, result=False):
+    # if (__utg_frame) { __utg_pointer(...); __utg_value(...); __utg_leaf(...); ...; __utg_end(); }
+    # __utg_frame is declared before it by instrument, = __utg_call(idx) with the cleanup
+    def call(name, *args):
+        return c_ast.FuncCall(c_ast.ID(name), c_ast.ExprList(list(args)))
+    def const(value):
+        return c_ast.Constant("int", str(value))
+    def sizeof(node):
+        return c_ast.UnaryOp("sizeof", node)
+    char_ptr = c_ast.Typename(None, [], None, c_ast.PtrDecl([], c_ast.TypeDecl(None, [], None, c_ast.IdentifierType(["char"]))))
+    void_ptr = c_ast.Typename(None, [], None, c_ast.PtrDecl([], c_ast.TypeDecl(None, ["const"], None, c_ast.IdentifierType(["void"]))))
+
+    body = []
+    layouts[func] = {}
+    for i, param in enumerate(cfg.params_table[func]):
+        name = c_ast.ID(param[1])
+        if isinstance(param[0], c_ast.PtrDecl) or isinstance(param[0], c_ast.ArrayDecl):
+            names = element_type(param[0], cfg)
+            # *(T *) 0 is never evaluated, it only gives the element type to sizeof and _Generic
+            element = c_ast.UnaryOp("*", c_ast.Cast(c_ast.Typename(None, [], None, c_ast.PtrDecl([], c_ast.TypeDecl(None, [], None, c_ast.IdentifierType(names)))), const(0)))
+            pointee = resolve_type(param[0].type, cfg)
+            void = isinstance(pointee, c_ast.TypeDecl) and isinstance(pointee.type, c_ast.IdentifierType) and pointee.type.names == ['void']
+            fallback = const(1) if void else sizeof(c_ast.UnaryOp("*", name))
+            graph = graph_type(param[0].type, cfg, types) if cfg.graph_depth else 0
+            body.append(call("__utg_pointer", const(i), c_ast.Cast(void_ptr, name), fallback, sizeof(type_name(names)), call("__UTG_KIND", element), const(graph)))
+        else:
+            tree = layouts[func][param[1]] = layout(param[0], name, cfg)
+            body.append(call("__utg_value", const(i), c_ast.UnaryOp("&", name), sizeof(name), const(len(leaves(tree)))))
+            for leaf in leaves(tree):
+                offset = c_ast.BinaryOp("-", c_ast.Cast(char_ptr, c_ast.UnaryOp("&", leaf[1])), c_ast.Cast(char_ptr, c_ast.UnaryOp("&", name)))
+                if leaf[0] == "scalar":
+                    body.append(call("__utg_leaf", offset, sizeof(leaf[1]), const(1), call("__UTG_KIND", leaf[1])))
+                elif leaf[0] == "array":
+                    count = c_ast.BinaryOp("/", sizeof(leaf[1]), sizeof(leaf[2]))
+                    body.append(call("__utg_leaf", offset, sizeof(leaf[2]), count, call("__UTG_KIND", leaf[2])))
+                else:
+                    body.append(call("__utg_leaf", offset, const(1), sizeof(leaf[1]), const(1)))
+    if result:
+        retval = c_ast.ID("__utg_retval")
+        body.append(call("__utg_result", c_ast.UnaryOp("&", retval), sizeof(retval), call("__UTG_KIND", retval)))
+    body.append(call("__utg_end"))
+    return c_ast.If(c_ast.ID("__utg_frame"), c_ast.Compound(body), None)
+
+
+def instrument(funcs, cfg, layouts):
+    # inserts the prologue of each function right after the opening brace of its body,
+    # on the same line so that line numbers do not change
+    from pycparser import c_generator
+    with open(cfg.filename) as f:
+        lines = f.read().split("\n")
+    generator = c_generator.CGenerator()
+    types = OrderedDict()
+    edits = []
+    for idx, func in enumerate(funcs):
+        coord = cfg.nodes_table[func].body.coord
+        if os.path.basename(coord.file) != os.path.basename(cfg.filename):
+            print("Cannot instrument", func, "defined in", coord.file)
+            continue
+        line, column = coord.line - 1, max((coord.column or 1) - 1, 0)
+        while "{" not in lines[line][column:]:
+            line, column = line + 1, 0
+        column = lines[line].index("{", column) + 1
+        # attributes are not in the c_ast, the declaration is written as text
+        prologue = f"unsigned long long __utg_frame __attribute__((cleanup(__utg_return))) = __utg_call({idx}); "
+        returns = return_edits(func, cfg, lines)
+        if returns:
+            # declared before __utg_frame, still alive when its cleanup runs
+            names = cfg.nodes_table[func].decl.type.type.type.names
+            prologue = f"{' '.join(names)} __utg_retval = 0; " + prologue
+            edits.extend(returns)
+        prologue += generator.visit(native_prologue(func, idx, cfg, layouts, types, bool(returns))).replace("\n", " ")
+        edits.append((line, column, " " + prologue))
+    for line, column, text in sorted(edits, reverse=True):
+        lines[line] = lines[line][:column] + text + lines[line][column:]
+    stride = cfg.stride if cfg.sampling == "stride" else 1
+    return native_runtime.format(n_funcs=max(len(funcs), 1), invocations=cfg.invocations, stride=stride,
+                                 reservoir=int(cfg.sampling == "reservoir"), graph_depth=cfg.graph_depth,
+                                 graph_budget=cfg.graph_budget, filename=cfg.filename) + "\n".join(lines) + "\n" + graph_table(types)
+
+
+def decode_leaf(data, leaf):
+    # offset elem_size count kind of a value leaf to the decoded value
+    offset, elem_size, count, kind = leaf
+    data = data[offset:offset + elem_size * count]
+    if not kind & 1 and elem_size not in (1, 2, 4, 8):
+        return list(decode(data, 1, False, False)) # aggregate the fake libc typedefs took for a scalar
+    return list(decode(data, elem_size, bool(kind & 2), bool(kind & 4)))
+
+
+def decode_value(tree, data, leaves_data):
+    # layout tree and serialized leaves to the same values the gdb capture produces
+    if tree[0] == "struct":
+        return {"fields": [[name, decode_value(field, data, leaves_data)] for name, field in tree[1]]}
+    value = decode_leaf(data, leaves_data.pop(0))
+    return value[0] if tree[0] == "scalar" and len(value) == 1 else value
+
+
+def load_trace(trace_path, funcs, cfg, layouts):
+    # native trace to capture records, same format as load_capture
+    slots = {}
+    hits = {}
+    if not os.path.exists(trace_path):
+        return distinct_invocations(slots, funcs)
+    with open(trace_path, "rb") as f:
+        data = memoryview(f.read())
+    pos = 0
+    def u64s(n):
+        nonlocal pos
+        values = struct.unpack_from(f"={n}Q", data, pos)
+        pos += 8 * n
+        return values
+    try:
+        while pos < len(data):
+            tag = bytes(data[pos:pos+1])
+            pos += 1
+            if tag == b"C":
+                func, slot, hit = u64s(3)
+                func = funcs[func]
+                params = {}
+            elif tag == b"P":
+                param, base, offset, size, elem_size, kind = u64s(6)
+                name = cfg.params_table[func][param][1]
+                params[name] = {"func": func, "param": name, "kind": "pointer", "base": base, "offset": offset, "size": size,
+                                "elem_size": elem_size, "scalar": bool(kind & 1), "signed": bool(kind & 2), "floating": bool(kind & 4),
+                                "data": data[pos:pos + size]}
+                if params[name]["data"].nbytes != size:
+                    break
+                pos += size
+            elif tag == b"V":
+                param, size, n_leaves = u64s(3)
+                name = cfg.params_table[func][param][1]
+                value = data[pos:pos + size]
+                pos += size
+                leaves_data = [u64s(4) for _ in range(n_leaves)]
+                value = decode_value(layouts[func][name], value, leaves_data)
+                if isinstance(value, dict):
+                    params[name] = {"func": func, "param": name, "kind": "struct", "fields": value["fields"]}
+                else:
+                    params[name] = {"func": func, "param": name, "kind": "value", "value": value}
+            elif tag == b"O":
+                obj, param, base, size = u64s(4)
+                record = {"func": func, "kind": "object", "id": obj, "base": base, "size": size}
+                if param == (1 << 64) - 1:
+                    record["data"] = data[pos:pos + size]
+                    if record["data"].nbytes != size:
+                        break
+                    pos += size
+                else:
+                    record["param"] = cfg.params_table[func][param][1] # same bytes as the parameter
+                params.setdefault("graph", {"kind": "graph", "objects": [], "links": []})["objects"].append(record)
+            elif tag == b"L":
+                source, offset, target, target_offset = u64s(4)
+                target = None if target == (1 << 64) - 1 else target
+                params["graph"]["links"].append((source, offset, target, target_offset))
+            elif tag == b"E":
+                # a new call in this slot replaces the previous one
+                slots.setdefault(func, {})[slot] = params
+                hits[func, slot] = hit
+            elif tag == b"R":
+                post_func, post_slot, post_hit, regions = u64s(4)
+                post_func = funcs[post_func]
+                post = {}
+                for _ in range(regions):
+                    param, size = u64s(2)
+                    post[cfg.params_table[post_func][param][1]] = data[pos:pos + size]
+                    if post[cfg.params_table[post_func][param][1]].nbytes != size:
+                        raise struct.error("truncated")
+                    pos += size
+                kind, size = u64s(2)
+                value = data[pos:pos + size]
+                if value.nbytes != size:
+                    raise struct.error("truncated")
+                pos += size
+                # only if the call was not replaced in the meantime
+                if hits.get((post_func, post_slot)) == post_hit:
+                    for name, view in post.items():
+                        slots[post_func][post_slot][name]["post"] = view
+                    if size and kind & 1:
+                        slots[post_func][post_slot]["return"] = {"func": post_func, "kind": "return", "hit": post_hit, "slot": post_slot,
+                                                                 "value": decode_leaf(value, (0, size, 1, kind))[0]}
+            else:
+                break
+    except struct.error:
+        pass # truncated trace, the program died while writing, the last call is incomplete
+    return distinct_invocations(slots, funcs)
+
+
+def capture_native(funcs, cfg, name):
+    # rewrites and builds the source once, one native run of the program per workload captures all funcs
+    layouts = {}
+    source = f"{cfg.tmp_folder}{name}_instrumented.c"
+    with cfg.profiler.stage("instrument"), open(source, "w") as f:
+        print(instrument(funcs, cfg, layouts), file=f)
+    binary = build_binary(cfg, source, native_flags, name)
+    return capture_workloads(lambda folder, workload: run_native(binary, funcs, cfg, layouts, name, folder, workload), cfg, funcs)
+
+
+def run_native(binary, funcs, cfg, layouts, name, folder, workload=None):
+    # one run of the instrumented binary, with the arguments, stdin, environment and cwd of workload
+    workload = workload or {}
+    trace_path = os.path.abspath(f"{folder}{name}_trace.bin")
+    if os.path.exists(trace_path):
+        os.remove(trace_path)
+    env = dict(os.environ, **workload.get("env", {}), UTG_TRACE=trace_path, ASAN_OPTIONS="detect_leaks=0")
+    with cfg.profiler.stage("run", workload.get("name", name)), \
+            open(workload["stdin"], "rb") if workload.get("stdin") else contextlib.nullcontext() as stdin:
+        status = run_process([os.path.abspath(binary), *workload.get("args", [])], f"{folder}{name}_run.log", cfg.stage_timeout, cfg.memory_limit,
+                             stdin=stdin, env=env, cwd=workload.get("cwd"))["status"]
+    if status != "ok":
+        # the trace is flushed after each call, the calls captured so far are kept
+        print(f"{binary} killed ({status}), see {folder}{name}_run.log")
+
+    with cfg.profiler.stage("load", workload.get("name", name)):
+        return load_trace(trace_path, funcs, cfg, layouts)
+
+
+########################################################################################
+#                                     WORKLOADS                                        #
+########################################################################################
+# --workloads: runs of the program to capture, a json list of
+#   [{"name": "small", "args": ["-n", "3"], "stdin": "corpus/small.txt", "env": {"MODE": "fast"}, "cwd": "."}, ...]
+# with every key optional and the paths relative to the json file. Each workload is captured by its
+# own gdb session or instrumented run, in parallel, in tmp_folder/workloads/<name>/. The calls of all
+# the workloads are merged per function, in workload order, without the ones with the same inputs
+def load_workloads(path):
+    with open(path) as f:
+        entries = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    workloads = []
+    for i, entry in enumerate(entries):
+        workload = {"name": entry.get("name", f"w{i}"), "args": [str(arg) for arg in entry.get("args", [])],
+                    "env": {name: str(value) for name, value in entry.get("env", {}).items()}}
+        for key in ("stdin", "cwd"):
+            if entry.get(key):
+                workload[key] = os.path.join(base, entry[key])
+        workloads.append(workload)
+    if len({workload["name"] for workload in workloads}) != len(workloads):
+        raise ValueError(f"the workloads of {path} need distinct names")
+    return workloads
+
+
+def workloads_key(cfg):
+    # the workloads and the content of their stdin files, for the manifest
+    if not cfg.workloads:
+        return None
+    key = hashlib.sha256(json.dumps(cfg.workloads, sort_keys=True).encode())
+    for workload in cfg.workloads:
+        if workload.get("stdin") and os.path.exists(workload["stdin"]):
+            with open(workload["stdin"], "rb") as f:
+                key.update(hashlib.sha256(f.read()).digest())
+    return key.hexdigest()
+
+
+def merge_captures(results, funcs):
+    # [{func: [params]}] of the workloads to one {func: [params]}, without calls with the same inputs
+    captures = {}
+    for func in funcs:
+        seen = set()
+        for result in results:
+            for params in result.get(func, []):
+                digest = invocation_hash(params)
+                if digest not in seen:
+                    seen.add(digest)
+                    captures.setdefault(func, []).append(params)
+    return captures
+
+
+def capture_workloads(run, cfg, funcs, folder=None, jobs=None):
+    # run(folder, workload) captures one run of the program. Without --workloads it runs once in
+    # folder (tmp_folder by default), else once per workload in folder/workloads/<name>/, jobs at a time
+    folder = folder or cfg.tmp_folder
+    if not cfg.workloads:
+        return run(folder, None)
+    folders = []
+    for workload in cfg.workloads:
+        folders.append(f"{folder}workloads/{workload['name']}/")
+        os.makedirs(folders[-1], exist_ok=True)
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max(min(jobs or cfg.jobs, len(folders)), 1)) as pool:
+        results = list(pool.map(run, folders, cfg.workloads))
+    captures = merge_captures(results, funcs)
+    for func in funcs:
+        print("Captured", len(captures.get(func, [])), "distinct calls of", func, "in", len(results), "workloads")
+    return captures
+
+
+########################################################################################
+#                                  BUILD UNIT TEST                                     #
+#######################################################################################
+def initializer(value):
+    # captured value (see to_json in the capture script) to a c initializer
+    if isinstance(value, dict):
+        return c_ast.InitList([initializer(field_value) for _, field_value in value["fields"]])
+    if isinstance(value, list):
+        return c_ast.InitList([initializer(element) for element in value])
+    if isinstance(value, int):
+        return c_ast.Constant(c_ast.IdentifierType(['int']), hex(value))
+    if value is None:
+        return c_ast.InitList([c_ast.Constant(c_ast.IdentifierType(['int']), "0")]) # unreadable during the capture
+    return c_ast.Constant(c_ast.IdentifierType(['double']), c_literal(value))
+
+
+def printed(value, fmt):
+    # value as the test prints it with fmt, None when the output cannot be predicted
+    if fmt == "%g":
+        return "%g" % value if isinstance(value, float) else None
+    if not isinstance(value, int):
+        return None
+    if fmt == "%llx":
+        return "%x" % (value & 0xffffffffffffffff)
+    if fmt == "%x":
+        return "%x" % (value & 0xffffffff) # promoted to int
+    return str((value + 2**31) % 2**32 - 2**31)
+
+
+def build_unit_test(func, cfg, records, index=0):
+    print("Building unit test for ", func)
+
+    # records are the capture records of one call of this function, {param: record} (see capture)
+    # index tells apart the tests of the distinct calls of the same function.
+    # The output expected from the state after the call goes to <test>.expected, one line per
+    # printed line, ? for the lines that cannot be predicted
+    pointers_table = OrderedDict() # associates a pointer to its characteristics 
+    suffix = f"_{index}" if index else ""
+    sidecars = [] # buffers above cfg.inline_limit, as raw bytes
+    expected = []
 
     # build the test functoin
     main_decl = c_ast.Decl("main", [], [], [], [], c_ast.FuncDecl(c_ast.ParamList([]), c_ast.TypeDecl("main", [], [], c_ast.IdentifierType(['int']))), None, None)
     main_def = c_ast.FuncDef(main_decl, None, c_ast.Compound([]))
+    # the buffers are passed as pointers to their real type, often a struct: _Alignas(max_align_t)
+    aligned = [c_ast.Alignas(c_ast.Typename(None, [], None, c_ast.TypeDecl(None, [], None, c_ast.IdentifierType(['max_align_t']))))]
     # add def of params
     n_params = len(cfg.params_table[func])
     for i in range(n_params):
-        # find init values
-        lines = dbg_out.split("\n")
-        multiline = False
-        for j in range(len(lines)):
-            if not multiline:
-                line = lines[j]
+        # init values
+        name = cfg.params_table[func][i][1]
+        record = records[name]
+        if record["kind"] == "pointer":
+            pointer = pointers_table[name] = PointerData()
+            pointer.base = record["base"]
+            pointer.byte_offset = record["offset"]
+            pointer.byte_size = record["size"]
+            pointer.type_size = record["elem_size"]
+            pointer.element_offset = pointer.byte_offset//pointer.type_size
+            pointer.floating = record["floating"]
+            if record["scalar"]:
+                pointer.type_names = element_type(cfg.params_table[func][i][0], cfg)
+            if pointer.byte_size > cfg.inline_limit:
+                # raw bytes to a sidecar file, loaded by the test, the buffer is never decoded
+                pointer.element_size = pointer.byte_size // pointer.type_size
+                sidecar = f"{func}_test{suffix}_{name}.bin"
+                with open(cfg.tmp_folder + sidecar, "wb") as f:
+                    f.write(record["data"])
+                sidecars.append(sidecar)
+                init = None
             else:
-                line = line + lines[j]
-            if line.startswith(f"${i+1} = "):
-                if lines[j+1].startswith("$") or lines[j+1].startswith("Breakpoint") or "process" in lines[j+1] or line.count("{") == line.count("}"):    
-                    multiline = False
-                    # is a pointer
-                    # pointers_table[params_table[func][i][1]] = (0,0)
-                    init = c_ast.Constant(c_ast.IdentifierType(['int']), "0")
-                    if "{" in line and line.count("=") == 1:
-                        # is a single array
-                        value = line.split(" = ")[1]
-                        value = value.replace("{", "[").replace("}", "]")
-                        if "repeat" in value:
-                            value = fix_repeat(value)
-                        value = eval(value)
-                        pointers_table[cfg.params_table[func][i][1]].element_size = len(value) # array dimensions and sizes
-                        init = c_ast.InitList([c_ast.Constant(c_ast.IdentifierType(['int']), str(val)) for val in value])
-                    elif "{" in line and line.count("=") > 1:
-                        # it's a struct
-                        # needs to go from {size = 0x14, key = 0x37} to [0x14, key = 0x37]
-                        value = "=".join(line.split(" = ")[1:])[1:-1]
-                        elements = value.split(",")
-                        cfg.structs_table[cfg.params_table[func][i][1]] = []
-                        values = []
-                        for element in elements:
-                            split = element.split("=")
-                            values.append(split[1].strip())
-                            cfg.structs_table[cfg.params_table[func][i][1]].append(split[0].strip())
-                        value = "[" + ", ".join(values) + "]"
-                        value = fix_repeat(value)
-                        value = eval(value)
-                        init = c_ast.InitList([c_ast.Constant(c_ast.IdentifierType(['int']), str(val)) for val in value])
-                    else:
-                        value = line.split(" = ")[1]
-                        init =c_ast.Constant(c_ast.IdentifierType(['int']), value)
-                        #pointers_table[params_table[func][i][1]] = (0,0)
-                else:
-                    multiline = True
+                pointer.values = decode(record["data"], record["elem_size"], record["signed"], record["floating"])
+                pointer.element_size = len(pointer.values) # array dimensions and sizes
+                init = bulk_initializer(pointer.values)
+        elif record["kind"] == "struct":
+            cfg.structs_table[name] = [field for field, _ in record["fields"]]
+            init = initializer(record)
+        else:
+            init = initializer(record["value"])
         if isinstance(cfg.params_table[func][i][0], c_ast.PtrDecl) or isinstance(cfg.params_table[func][i][0], c_ast.ArrayDecl):
-            array_type = c_ast.TypeDecl(cfg.params_table[func][i][1], [], [], c_ast.IdentifierType(['unsigned','int']))
-            main_def.body.block_items.append(c_ast.Decl(cfg.params_table[func][i][1], [], [], [], None, c_ast.ArrayDecl(array_type, None, None), init, None))
+            array_type = c_ast.TypeDecl(cfg.params_table[func][i][1], [], [], c_ast.IdentifierType(pointers_table[cfg.params_table[func][i][1]].type_names))
+            if init is None:
+                # static, large buffers do not fit on the stack
+                dim = c_ast.Constant(c_ast.IdentifierType(['int']), str(pointers_table[name].element_size))
+                main_def.body.block_items.append(c_ast.Decl(name, [], aligned, ["static"], [], c_ast.ArrayDecl(array_type, dim, None), None, None))
+                main_def.body.block_items.append(c_ast.FuncCall(c_ast.ID("__utg_load"), c_ast.ExprList([c_ast.ID(name), c_ast.UnaryOp("sizeof", c_ast.ID(name)), c_ast.Constant(c_ast.IdentifierType(['char']), f'"{sidecars[-1]}"')])))
+            else:
+                main_def.body.block_items.append(c_ast.Decl(cfg.params_table[func][i][1], [], aligned, [], None, c_ast.ArrayDecl(array_type, None, None), init, None))
         elif isinstance(cfg.params_table[func][i][0], c_ast.TypeDecl): # struct
             main_def.body.block_items.append(c_ast.Decl(cfg.params_table[func][i][1], [], [], [], None, c_ast.TypeDecl(cfg.params_table[func][i][1], None, None, cfg.params_table[func][i][0]), init, None))
         else:
             main_def.body.block_items.append(c_ast.Decl(cfg.params_table[func][i][1], [], [], [], None, cfg.params_table[func][i][0].type, init, None))
+    # objects reached through the pointers of the parameters (see walk in the capture script),
+    # declared as 8 byte words, aligned like the parameters, then the pointers between them are patched in
+    graph = records.get("graph", {"objects": [], "links": []})
+    objects = {}
+    for obj in graph["objects"]:
+        if "param" in obj:
+            objects[obj["id"]] = obj["param"] # the buffer of the parameter
+            continue
+        name = objects[obj["id"]] = f"__utg_obj{obj['id']}"
+        words = bytes(obj["data"]).ljust(max((obj["size"] + 7) // 8, 1) * 8, b"\0")
+        dim = c_ast.Constant(c_ast.IdentifierType(['int']), str(len(words) // 8))
+        word_type = c_ast.TypeDecl(name, [], [], c_ast.IdentifierType(['unsigned', 'long', 'long']))
+        if obj["size"] > cfg.inline_limit:
+            sidecar = f"{func}_test{suffix}_obj{obj['id']}.bin"
+            with open(cfg.tmp_folder + sidecar, "wb") as f:
+                f.write(words)
+            sidecars.append(sidecar)
+            main_def.body.block_items.append(c_ast.Decl(name, [], aligned, ["static"], [], c_ast.ArrayDecl(word_type, dim, None), None, None))
+            main_def.body.block_items.append(c_ast.FuncCall(c_ast.ID("__utg_load"), c_ast.ExprList([c_ast.ID(name), c_ast.UnaryOp("sizeof", c_ast.ID(name)), c_ast.Constant(c_ast.IdentifierType(['char']), f'"{sidecar}"')])))
+        else:
+            init = bulk_initializer(memoryview(words).cast("Q"), "%#xULL".__mod__)
+            main_def.body.block_items.append(c_ast.Decl(name, [], aligned, [], None, c_ast.ArrayDecl(word_type, dim, None), init, None))
+    char_ptr = c_ast.Typename(None, [], None, c_ast.PtrDecl([], c_ast.TypeDecl(None, [], None, c_ast.IdentifierType(['char']))))
+    void_ptr_ptr = c_ast.Typename(None, [], None, c_ast.PtrDecl([], c_ast.PtrDecl([], c_ast.TypeDecl(None, [], None, c_ast.IdentifierType(['void'])))))
+    linked = set() # parameters whose buffers hold pointers, their printed bytes cannot be predicted
+    cut = False # a pointer was not followed, the call sees a smaller graph than the captured one
+    for source, offset, target, target_offset in graph["links"]:
+        # *(void **) ((char *) source + offset) = (char *) target + target_offset, or 0 when the target was not captured
+        slot = c_ast.UnaryOp("*", c_ast.Cast(void_ptr_ptr, c_ast.BinaryOp("+", c_ast.Cast(char_ptr, c_ast.ID(objects[source])), c_ast.Constant(c_ast.IdentifierType(['int']), str(offset)))))
+        if target is None:
+            value = c_ast.Constant(c_ast.IdentifierType(['int']), "0")
+            cut = True
+        else:
+            value = c_ast.BinaryOp("+", c_ast.Cast(char_ptr, c_ast.ID(objects[target])), c_ast.Constant(c_ast.IdentifierType(['int']), str(target_offset)))
+        main_def.body.block_items.append(c_ast.Assignment("=", slot, value))
+        linked.add(objects[source])
+
     # build param list for call to function
     expr_list = []
     for param in cfg.params_table[func]:
+        arg = c_ast.ID(param[1])
+        if param[1] in pointers_table and not pointers_table[param[1]].base:
+            arg = c_ast.Constant(c_ast.IdentifierType(['int']), "0") # null, or unreadable during the capture
+        elif param[1] in pointers_table and pointers_table[param[1]].byte_offset:
+            # the pointer was into the buffer, not at its start
+            arg = c_ast.BinaryOp("+", c_ast.Cast(char_ptr, arg), c_ast.Constant(c_ast.IdentifierType(['int']), str(pointers_table[param[1]].byte_offset)))
         #if not isinstance(param[0], c_ast.PtrDecl) and not isinstance(param[0], c_ast.ArrayDecl):
         if isinstance(param[0], c_ast.ArrayDecl): 
-            expr_list.append(c_ast.Cast(c_ast.PtrDecl( None,param[0].type) ,c_ast.ID(param[1])))
+            expr_list.append(c_ast.Cast(c_ast.PtrDecl( None,param[0].type) ,arg))
         else:
-            expr_list.append(c_ast.Cast(param[0],c_ast.ID(param[1])))
+            expr_list.append(c_ast.Cast(param[0],arg))
        
+    # the main of the source is linked as __utg_main (see validate), main would call the test itself
+    callee = "__utg_main" if func == "main" else func
+    # what the function prints comes before the marker, the output of the test after it
+    marker = c_ast.FuncCall(c_ast.ID("printf"), c_ast.ExprList([c_ast.Constant(c_ast.IdentifierType(['char']), f'"\\n{after_call_marker}\\n"')]))
     # check function node for return type
     if cfg.nodes_table[func].decl.type.type.type.names[0] == "void":
         # add call to function
-        main_def.body.block_items.append(c_ast.FuncCall(c_ast.ID(func), c_ast.ExprList(expr_list)))
+        main_def.body.block_items.append(c_ast.FuncCall(c_ast.ID(callee), c_ast.ExprList(expr_list)))
+        if cfg.verbose_tests:
+            main_def.body.block_items.append(marker)
     else:
         # need to add a variable to store the return value
         main_def.body.block_items.append(c_ast.Decl("ret", [], [], [], None, c_ast.TypeDecl("ret", [], [], c_ast.IdentifierType(cfg.nodes_table[func].decl.type.type.type.names)), None, None))
         # add call to function and assugn return value to ret
-        main_def.body.block_items.append(c_ast.Assignment("=", c_ast.ID("ret"), c_ast.FuncCall(c_ast.ID(func), c_ast.ExprList(expr_list))))
+        main_def.body.block_items.append(c_ast.Assignment("=", c_ast.ID("ret"), c_ast.FuncCall(c_ast.ID(callee), c_ast.ExprList(expr_list))))
         # add print of ret
-        main_def.body.block_items.append(c_ast.FuncCall(c_ast.ID("printf"), c_ast.ExprList([c_ast.Constant(c_ast.IdentifierType(['char']), f'"%d\\n"'), c_ast.ID("ret")])))                           
-    # add prints
-    for i in range(n_params):
+        if cfg.verbose_tests:
+            main_def.body.block_items.append(marker)
+            main_def.body.block_items.append(c_ast.FuncCall(c_ast.ID("printf"), c_ast.ExprList([c_ast.Constant(c_ast.IdentifierType(['char']), f'"%d\\n"'), c_ast.ID("ret")])))                           
+            expected.append(printed(records.get("return", {}).get("value"), "%d"))
+    # add prints, only with --verbose_tests
+    for i in range(n_params if cfg.verbose_tests else 0):
         if isinstance(cfg.params_table[func][i][0], c_ast.PtrDecl) or isinstance(cfg.params_table[func][i][0], c_ast.ArrayDecl):
             if cfg.params_table[func][i][1] in pointers_table:
-                code_str = array_printer.format(name=cfg.params_table[func][i][1], size=pointers_table[cfg.params_table[func][i][1]].element_size)
+                pointer = pointers_table[cfg.params_table[func][i][1]]
+                if pointer.floating:
+                    fmt, cast = "%g", "(double) "
+                elif pointer.type_size > 4:
+                    fmt, cast = "%llx", "(unsigned long long) "
+                else:
+                    fmt, cast = "%x", ""
+                code_str = array_printer.format(name=cfg.params_table[func][i][1], size=pointer.element_size, fmt=fmt, cast=cast)
+                record = records[cfg.params_table[func][i][1]]
+                if "post" in record and pointer.byte_size <= cfg.inline_limit and cfg.params_table[func][i][1] not in linked:
+                    values = [printed(value, fmt) for value in decode(record["post"], record["elem_size"], record["signed"], record["floating"])]
+                    expected.append(None if None in values else "".join(value + " " for value in values))
+                else:
+                    expected.append(None)
             else:
                 main_def.body.block_items.append(c_ast.FuncCall(c_ast.ID("printf"), c_ast.ExprList([c_ast.Constant(c_ast.IdentifierType(['char']), f'"%d\\n"'), c_ast.ID(cfg.params_table[func][i][1])])))
+                expected.append(None)
                 continue
-            for_ast = c_parser.CParser().parse(code_str).ext[0]
+            for_ast = shared_parser().parse(code_str).ext[0]
             main_def.body.block_items.extend(for_ast.body.block_items)
         elif isinstance(cfg.params_table[func][i][0], c_ast.TypeDecl) and isinstance(cfg.params_table[func][i][0].type, c_ast.Struct):
                 for element in cfg.structs_table[cfg.params_table[func][i][1]]:
                     main_def.body.block_items.append(c_ast.FuncCall(c_ast.ID("printf"), c_ast.ExprList([c_ast.Constant(c_ast.IdentifierType(['char']), f'"{element} %d\\n"'), c_ast.ID(f"{cfg.params_table[func][i][1]}.{element}")])))
+                # passed by value, unchanged by the call
+                fields = dict(records[cfg.params_table[func][i][1]].get("fields", []))
+                for element in cfg.structs_table[cfg.params_table[func][i][1]]:
+                    value = printed(fields.get(element), "%d")
+                    expected.append(None if value is None else f"{element} {value}")
         else:
             main_def.body.block_items.append(c_ast.FuncCall(c_ast.ID("printf"), c_ast.ExprList([c_ast.Constant(c_ast.IdentifierType(['char']), f'"%d\\n"'), c_ast.ID(cfg.params_table[func][i][1])])))
+            expected.append(printed(records[cfg.params_table[func][i][1]].get("value"), "%d"))
+
+    # self checks: the state recorded after the call is compared with memcmp, the return value with !=,
+    # each difference prints a FAIL line and the test exits with 1
+    checks = []
+    def check(condition, label):
+        checks.append(label)
+        fail = c_ast.FuncCall(c_ast.ID("printf"), c_ast.ExprList([c_ast.Constant(c_ast.IdentifierType(['char']), f'"FAIL {label}\\n"')]))
+        main_def.body.block_items.append(c_ast.If(condition, c_ast.Compound([fail, c_ast.Assignment("=", c_ast.ID("__utg_failed"), c_ast.Constant(c_ast.IdentifierType(['int']), "1"))]), None))
+    main_def.body.block_items.append(c_ast.Decl("__utg_failed", [], [], [], None, c_ast.TypeDecl("__utg_failed", [], [], c_ast.IdentifierType(['int'])), c_ast.Constant(c_ast.IdentifierType(['int']), "0"), None))
+    return_value = records.get("return", {}).get("value")
+    if cfg.nodes_table[func].decl.type.type.type.names[0] != "void" and isinstance(return_value, int) and not cut:
+        names = cfg.nodes_table[func].decl.type.type.type.names
+        value = c_ast.Cast(type_name(names), c_ast.Constant(c_ast.IdentifierType(['int']), hex(return_value & 0xffffffffffffffff) + "ULL"))
+        check(c_ast.BinaryOp("!=", c_ast.ID("ret"), value), "return")
+    for name, pointer in pointers_table.items():
+        if "post" not in records[name] or name in linked or not pointer.byte_size:
+            continue # not recorded, holds pointers into this process, or empty
+        post = bytes(records[name]["post"][:pointer.element_size * pointer.type_size])
+        expected_name = f"__utg_expected_{name}"
+        dim = c_ast.Constant(c_ast.IdentifierType(['int']), str(max(len(post), 1)))
+        byte_type = c_ast.TypeDecl(expected_name, [], [], c_ast.IdentifierType(['unsigned', 'char']))
+        if pointer.byte_size > cfg.inline_limit:
+            sidecar = f"{func}_test{suffix}_{name}_expected.bin"
+            with open(cfg.tmp_folder + sidecar, "wb") as f:
+                f.write(post)
+            sidecars.append(sidecar)
+            main_def.body.block_items.append(c_ast.Decl(expected_name, [], [], ["static"], [], c_ast.ArrayDecl(byte_type, dim, None), None, None))
+            main_def.body.block_items.append(c_ast.FuncCall(c_ast.ID("__utg_load"), c_ast.ExprList([c_ast.ID(expected_name), c_ast.Constant(c_ast.IdentifierType(['int']), str(len(post))), c_ast.Constant(c_ast.IdentifierType(['char']), f'"{sidecar}"')])))
+        else:
+            init = bulk_initializer(post or b"\0", str)
+            byte_type.quals = ["const"]
+            main_def.body.block_items.append(c_ast.Decl(expected_name, [], [], ["static"], [], c_ast.ArrayDecl(byte_type, dim, None), init, None))
+        size = c_ast.Constant(c_ast.IdentifierType(['int']), str(len(post)))
+        check(c_ast.BinaryOp("!=", c_ast.FuncCall(c_ast.ID("memcmp"), c_ast.ExprList([c_ast.ID(name), c_ast.ID(expected_name), size])), c_ast.Constant(c_ast.IdentifierType(['int']), "0")), name)
+    main_def.body.block_items.append(c_ast.Return(c_ast.ID("__utg_failed")))
 
+    from pycparser import c_generator
     generator = c_generator.CGenerator()
     with open(f"{cfg.tmp_folder}" + func + ".c", "w") as f:
-        children = []
-        explore_calls(func, children, cfg)
-        for child_func in children:
-            print(generator.visit(cfg.nodes_table[child_func]), file=f)
-    with open(f"{cfg.tmp_folder}" + func + "_test.c", "w") as f:
+        f.write(sliced_source([func], cfg))
+    with open(f"{cfg.tmp_folder}" + func + "_test" + suffix + ".c", "w") as f:
+        if not checks:
+            # nothing to compare after the call: no pointer parameters or only linked ones, and no return value
+            print(no_self_check, file=f)
+        print(self_check_includes, file=f)
+        if func == "main":
+            print("int __utg_main();", file=f)
+        if sidecars:
+            print(sidecar_loader.format(data_dir=os.path.abspath(cfg.tmp_folder) + os.sep), file=f)
         print(generator.visit(main_def), file=f)
+    outputs = [f"{func}.c", f"{func}_test{suffix}.c"]
+    if not checks:
+        print(f"Warning: {func}_test{suffix}.c has no self check, the state after the call cannot be compared")
+    if cfg.verbose_tests:
+        with open(f"{cfg.tmp_folder}{func}_test{suffix}.expected", "w") as f:
+            for line in expected:
+                print("?" if line is None else line, file=f)
+        outputs.append(f"{func}_test{suffix}.expected")
+    return [*outputs, *sidecars]
+
+
+
+########################################################################################
+#                                   GENERATE ALL                                       #
+########################################################################################
+# state shared with the workers. Workers are forked, so the ast and the captured buffers
+# are inherited instead of pickled
+worker_state = {}
+
+def generate_function(entry, func):
+    # builds the tests of one function, with --capture function it also runs its gdb session
+    # in a scratch folder of its own. Returns the structs found so that they can be merged, and
+    # the error that stopped it, which fails this function only
+    cfg, captures = worker_state["entries"][entry]
+    cfg.structs_table = {}
+    outputs = []
+    events = len(cfg.profiler.events)
+    try:
+        if captures is None:
+            folder = f"{cfg.tmp_folder}work/{func}/"
+            os.makedirs(folder, exist_ok=True)
+            # the functions already run in parallel, their workloads one at a time
+            captures = capture_workloads(lambda folder, workload: capture([func], cfg, func, folder, workload), cfg, [func], folder, 1)
+        for index, records in enumerate(captures.get(func, [])):
+            with cfg.profiler.stage("emit", func):
+                outputs.extend(build_unit_test(func, cfg, records, index))
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        print("Failed to generate the tests of", func, ":", error)
+        return func, {}, [], cfg.profiler.events[events:], error
+    return func, cfg.structs_table, sorted(set(outputs)), cfg.profiler.events[events:], None
+
+
+def generate_batch(entries, jobs):
+    # entries are [(cfg, captures, funcs)], the functions of all of them share one pool.
+    # Returns, for each entry, [(func, structs, output files, error)] in hierarchy order
+    worker_state["entries"] = [(cfg, captures) for cfg, captures, _ in entries]
+    tasks = [(entry, func) for entry, (_, _, funcs) in enumerate(entries) for func in funcs]
+    if jobs > 1 and len(tasks) > 1:
+        import multiprocessing
+        with multiprocessing.get_context("fork").Pool(min(jobs, len(tasks))) as pool:
+            results = pool.starmap(generate_function, tasks, chunksize=1)
+        # the profile of the workers is sent back with their results
+        for (entry, _), (*_, events, _) in zip(tasks, results):
+            entries[entry][0].profiler.events.extend(events)
+    else:
+        results = [generate_function(entry, func) for entry, func in tasks]
+    entry_results = [[] for _ in entries]
+    for (entry, _), (func, structs_table, outputs, _, error) in zip(tasks, results):
+        entry_results[entry].append((func, structs_table, outputs, error))
+    # merge in hierarchy order, the tables do not depend on which worker finished first
+    for (cfg, _, _), results in zip(entries, entry_results):
+        cfg.structs_table = {}
+        for _, structs_table, _, _ in results:
+            cfg.structs_table.update(structs_table)
+    return entry_results
+
+
+def generate_all(cfg, captures, funcs=None):
+    # returns [(func, structs, output files, error)] in hierarchy order
+    funcs = cfg.hierarchical_calls if funcs is None else funcs
+    return generate_batch([(cfg, captures, funcs)], cfg.jobs)[0]
+
+
+########################################################################################
+#                                     MANIFEST                                         #
+########################################################################################
+# tmp_folder/manifest.json records, for each function, a hash of its code, of the code it
+# depends on (see slice_units) and of the headers, together with the files generated for it. Only the functions whose hash changed
+# are captured again, the outputs of the others are kept from the previous run
+def function_hash(func, cfg):
+    # hash of the slice of the function: its code, its transitive callees and the types and globals they use,
+    # with the headers of the source, and those of the other files for the units imported from them
+    key = hashlib.sha256()
+    for line in cfg.units_table["includes"]:
+        key.update(f"{line}\0".encode())
+    key.update(f"{cfg.units_table.get('headers')}\0".encode())
+    for i in slice_units([func], cfg):
+        unit = cfg.units_table["units"][i]
+        key.update(f"{unit.get('headers', '')}{unit['text']}\0".encode())
+    return key.hexdigest()
+
+
+def capture_settings(cfg):
+    # what else the outputs depend on, a change regenerates everything
+    return {"file": os.path.abspath(cfg.filename), "capture": cfg.capture, "invocations": cfg.invocations,
+            "sampling": cfg.sampling, "stride": cfg.stride, "seed": cfg.seed, "inline_limit": cfg.inline_limit,
+            "verbose_tests": cfg.verbose_tests, "graph_depth": cfg.graph_depth, "graph_budget": cfg.graph_budget,
+            "workloads": workloads_key(cfg)}
+
+
+def load_manifest(cfg):
+    # returns the manifest, the current hashes and the functions to regenerate in hierarchy order
+    manifest = {"settings": None, "functions": {}}
+    if os.path.exists(f"{cfg.tmp_folder}manifest.json"):
+        with open(f"{cfg.tmp_folder}manifest.json") as f:
+            manifest = json.load(f)
+    if cfg.force or manifest["settings"] != capture_settings(cfg):
+        manifest = {"settings": capture_settings(cfg), "functions": {}}
+    hashes = {func: function_hash(func, cfg) for func in cfg.hierarchical_calls}
+    stale = []
+    for func in cfg.hierarchical_calls:
+        entry = manifest["functions"].get(func)
+        if entry is None or entry["hash"] != hashes[func] or "error" in entry \
+                or not all(os.path.exists(cfg.tmp_folder + output) for output in entry["outputs"]):
+            stale.append(func)
+            # the new capture may have fewer distinct calls, drop the old tests
+            for output in (entry or {}).get("outputs", []):
+                if os.path.exists(cfg.tmp_folder + output):
+                    os.remove(cfg.tmp_folder + output)
+        else:
+            print("Unchanged", func, "reusing", ", ".join(entry["outputs"]))
+    return manifest, hashes, stale
 
 
+def save_manifest(cfg, manifest, hashes, results):
+    for func, _, outputs, error in results:
+        manifest["functions"][func] = {"hash": hashes[func], "outputs": outputs}
+        if error:
+            manifest["functions"][func]["error"] = error # generated again by the next run
+    with open(f"{cfg.tmp_folder}manifest.json.tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(f"{cfg.tmp_folder}manifest.json.tmp", f"{cfg.tmp_folder}manifest.json")
+
+
+########################################################################################
+#                                      VALIDATE                                        #
+########################################################################################
+# --validate: builds and runs every test. A test checks itself and exits with 1 when the state
+# after the call differs from the recorded one, with --verbose_tests its output is also compared
+# with <test>.expected.
+# The functions of the source are compiled once to units.o, with static removed from the
+# functions so that the tests can link them and main renamed. The tests are compiled with a
+# prelude of the includes and of the declarations of the source, linked to units.o and run
+# in parallel with a timeout. The results go to tmp_folder/validation.json
+validate_flags = ["-g", "-O0", "-w"]
+
+def units_source(filename, units, names=None):
+    # the source with external linkage for its functions, all of them or those in names, units is its units table
+    with open(filename) as f:
+        text = f.read()
+    lines = text.split("\n")
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line) + 1)
+    spans = []
+    for unit in units["units"]:
+        if not unit.get("static") or "file" in unit or (names is not None and unit["name"] not in names):
+            continue
+        end = starts[unit["line"] - 1] + max((unit["column"] or 1) - 1, 0)
+        # the specifiers are between the end of the previous declaration and the name
+        start = max(text.rfind(";", 0, end), text.rfind("}", 0, end), text.rfind("\n#", 0, end)) + 1
+        spans.append((start, end))
+    for start, end in sorted(spans, reverse=True):
+        specifiers = re.sub(r"\b(static|inline|__inline__|__inline)\b", lambda m: " " * len(m.group()), text[start:end])
+        text = text[:start] + specifiers + text[end:]
+    return text
+
+
+def prelude(cfg):
+    # includes of the source and its own types and function prototypes, for the tests
+    lines = list(OrderedDict.fromkeys(["#include <stdio.h>", *cfg.units_table["includes"]]))
+    for unit in cfg.units_table["units"]:
+        if unit["kind"] == "type":
+            lines.append(unit["text"])
+        elif "prototype" in unit and unit["name"] != "main":
+            lines.append(unit["prototype"])
+    return "\n".join(lines) + "\n"
+
+
+def run_test(cfg, test, units, header):
+    # builds and runs one test, returns its result
+    name = test[:-2]
+    result = {"test": test}
+    binary = f"{cfg.tmp_folder}validate/{name}"
+    build = run_process([compiler, *validate_flags, "-include", header, "-I", os.path.dirname(os.path.abspath(cfg.filename)),
+                         *cfg.cpp_args[1:], *linked_flags(cfg), cfg.tmp_folder + test, *units, "-o", binary, "-lm"],
+                        f"{binary}_build.log", cfg.stage_timeout, cfg.memory_limit)
+    if build["status"] != "ok" or build["returncode"] != 0:
+        return dict(result, status="build", detail=build["tail"][-2000:])
+    run = run_process([os.path.abspath(binary)], f"{binary}.out", cfg.timeout, cfg.memory_limit, cwd=cfg.tmp_folder)
+    if run["status"] != "ok":
+        return dict(result, status=run["status"])
+    if run["returncode"] == 1 and "FAIL " in run["tail"]:
+        # a self check of the test failed
+        return dict(result, status="fail", detail="".join(line for line in run["tail"].splitlines(True) if line.startswith("FAIL ")))
+    if run["returncode"] != 0:
+        return dict(result, status="crash", detail=f"exit code {run['returncode']}\n" + run["tail"][-2000:])
+    with open(cfg.tmp_folder + test) as f:
+        unchecked = f.readline().strip() == no_self_check
+    if not os.path.exists(f"{cfg.tmp_folder}{name}.expected"):
+        # the test only ran to the end
+        return dict(result, status="unchecked" if unchecked else "pass", checked=0)
+    with open(f"{cfg.tmp_folder}{name}.expected") as f:
+        expected = f.read().split("\n")[:-1]
+    with open(f"{binary}.out", errors="replace") as f:
+        output = f.read().split("\n")
+    if output and output[-1] == "":
+        output.pop()
+    if after_call_marker in output:
+        output = output[len(output) - output[::-1].index(after_call_marker):]
+    if len(output) != len(expected):
+        return dict(result, status="fail", detail=f"{len(output)} lines printed, {len(expected)} expected")
+    checked = 0
+    for i, (line, expected_line) in enumerate(zip(output, expected)):
+        if expected_line == "?":
+            continue
+        checked += 1
+        if line.rstrip() != expected_line.rstrip():
+            return dict(result, status="fail", detail=f"line {i + 1}: printed {line.rstrip()!r}, expected {expected_line.rstrip()!r}")
+    return dict(result, status="unchecked" if unchecked and not checked else "pass", checked=checked)
+
+
+def validate(cfg, manifest):
+    tests = [output for func in cfg.hierarchical_calls for output in manifest["functions"].get(func, {}).get("outputs", [])
+             if re.search(r"_test(_\d+)?\.c$", output)]
+    os.makedirs(f"{cfg.tmp_folder}validate/", exist_ok=True)
+    header = f"{cfg.tmp_folder}validate/prelude.h"
+    with open(header, "w") as f:
+        f.write(prelude(cfg))
+    # the source and each file linked with it (see linked_files), whose static functions stay
+    # static unless they were imported, another file can have one of the same name
+    sources = [(cfg.filename, [], cfg.units_table, None)]
+    if cfg.linked_files:
+        with open_index(cfg.index) as db:
+            for path, file_args in cfg.linked_files:
+                table = json.loads(db.execute("SELECT units FROM files WHERE path = ?", (path,)).fetchone()[0])
+                sources.append((path, file_args, table, {unit["name"] for unit in cfg.units_table["units"] if unit.get("file") == path}))
+    summary = {"passed": 0, "failed": 0, "unchecked": 0, "tests": []}
+    with cfg.profiler.stage("validate"):
+        try:
+            units = []
+            for k, (path, file_args, table, names) in enumerate(sources):
+                source = f"{cfg.tmp_folder}validate/units{f'_{k}' if k else ''}.c"
+                with open(source, "w") as f:
+                    f.write(units_source(path, table, names))
+                units.append(build_binary(cfg, source, [*validate_flags, "-c", "-Dmain=__utg_main", *file_args], os.path.basename(source)[:-2] + ".o", path))
+        except RuntimeError as e:
+            summary["error"] = str(e)
+            tests = []
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(max(cfg.jobs, 1)) as pool:
+            summary["tests"] = list(pool.map(lambda test: run_test(cfg, test, units, header), tests))
+    for result in summary["tests"]:
+        if result["status"] == "pass":
+            summary["passed"] += 1
+        elif result["status"] == "unchecked":
+            summary["unchecked"] += 1
+        else:
+            summary["failed"] += 1
+            print("FAILED", result["test"], result["status"], result.get("detail", "").split("\n")[0])
+    with open(f"{cfg.tmp_folder}validation.json", "w") as f:
+        json.dump(summary, f, indent=1)
+    print(f"Validation: {summary['passed']} passed, {summary['failed']} failed, {summary['unchecked']} without checks" + (f", {summary['error']}" if "error" in summary else ""))
+    return summary
+
+
+########################################################################################
+#                                       INDEX                                          #
+########################################################################################
+# --index: sqlite database of the definitions, signatures and call edges of every file of a
+# project, so that calls into other translation units are followed without parsing them again.
+# A file is indexed from its parse tables, and again only when its parse key changes:
+#   files(id, path, hash, cpp_args, units, types)  units: units_table as json, types: pickled typedefs and struct decls
+#   functions(file, name, line, static, signature, tables)  signature: prototype, tables: pickled FuncDef and params
+#   calls(file, caller, callee)
+#   symbols(file, name, kind, static)  functions and globals the file defines
+#   refs(file, name)                   names the file uses and does not define
+# explore_calls imports the functions reached from the top that another file defines, with the
+# units of their slice, and the files defining the symbols the source uses are linked with it
+index_schema = """
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, hash TEXT, cpp_args TEXT, units TEXT, types BLOB);
+CREATE TABLE IF NOT EXISTS functions (file INTEGER, name TEXT, line INTEGER, static INTEGER, signature TEXT, tables BLOB);
+CREATE TABLE IF NOT EXISTS calls (file INTEGER, caller TEXT, callee TEXT);
+CREATE TABLE IF NOT EXISTS symbols (file INTEGER, name TEXT, kind TEXT, static INTEGER);
+CREATE TABLE IF NOT EXISTS refs (file INTEGER, name TEXT);
+CREATE INDEX IF NOT EXISTS functions_name ON functions (name);
+CREATE INDEX IF NOT EXISTS calls_caller ON calls (file, caller);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name);
+CREATE INDEX IF NOT EXISTS refs_file ON refs (file);
+"""
+
+@contextlib.contextmanager
+def open_index(path):
+    # one connection per use, the server threads and the batch entries do not share one
+    import sqlite3
+    db = sqlite3.connect(path, timeout=60)
+    try:
+        db.executescript(index_schema)
+        with db: # commits on success
+            yield db
+    finally:
+        db.close()
+
+
+def deep_dumps(value):
+    # the c_ast nodes are deep, pickle recurses along them
+    import pickle
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 100000))
+    try:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def deep_loads(data):
+    import pickle
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 100000))
+    try:
+        return pickle.loads(data)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def unit_names(table):
+    # index of each unit of a units table -> names it defines
+    names = {}
+    for name, indices in table["defined"].items():
+        for i in indices:
+            names.setdefault(i, []).append(name)
+    return names
+
+
+def index_stale(db, cfg):
+    row = db.execute("SELECT hash FROM files WHERE path = ?", (os.path.realpath(cfg.filename),)).fetchone()
+    return row is None or row[0] != parse_key(cfg)
+
+
+def index_file(db, cfg):
+    # (re)writes the rows of cfg.filename from its parse tables
+    path = os.path.realpath(cfg.filename)
+    row = db.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+    if row is not None:
+        for table in ("functions", "calls", "symbols", "refs"):
+            db.execute(f"DELETE FROM {table} WHERE file = ?", row)
+        db.execute("DELETE FROM files WHERE id = ?", row)
+    types = deep_dumps({"typedefs_table": cfg.typedefs_table, "struct_decls": cfg.struct_decls})
+    file = db.execute("INSERT INTO files (path, hash, cpp_args, units, types) VALUES (?, ?, ?, ?, ?)",
+                      (path, parse_key(cfg), json.dumps(cfg.cpp_args[1:]), json.dumps(cfg.units_table), types)).lastrowid
+    names = unit_names(cfg.units_table)
+    uses, definitions = set(), set()
+    for i, unit in enumerate(cfg.units_table["units"]):
+        uses.update(unit["uses"])
+        if unit["kind"] == "prototype" or unit["text"].startswith("extern "):
+            continue # declarations, the definition is elsewhere
+        definitions.update(names.get(i, []))
+        name = unit["name"]
+        if unit["kind"] == "function":
+            tables = {"node": cfg.nodes_table[name], "params": cfg.params_table[name], "pointers": cfg.params_pointers_table.get(name)}
+            db.execute("INSERT INTO functions VALUES (?, ?, ?, ?, ?, ?)", (file, name, unit["line"], unit["static"], unit["prototype"], deep_dumps(tables)))
+            db.executemany("INSERT INTO calls VALUES (?, ?, ?)", [(file, name, callee) for callee in OrderedDict.fromkeys(cfg.calls_table[name])])
+            db.execute("INSERT INTO symbols VALUES (?, ?, ?, ?)", (file, name, "function", unit["static"]))
+        elif unit["kind"] == "global" and name is not None:
+            db.execute("INSERT INTO symbols VALUES (?, ?, ?, ?)", (file, name, "global", unit["text"].startswith("static ")))
+    db.executemany("INSERT INTO refs VALUES (?, ?)", [(file, name) for name in sorted(uses - definitions)])
+    print("Indexed", cfg.filename, flush=True)
+
+
+def merge_units(cfg, table, funcs, path):
+    # appends the slice of funcs in the units table of path to cfg.units_table. A unit defining a
+    # name the slices already define (a type of a shared header) is left out, except that definitions
+    # replace prototypes. A function of path with the name of another one (a static helper of the same
+    # name) cannot be replaced: the funcs whose slice needs it are not merged and are returned
+    names = unit_names(table)
+    units = cfg.units_table
+    conflicts = {i for i in slice_units(funcs, cfg, table) if table["units"][i]["kind"] == "function"
+                 and any(units["units"][j]["kind"] == "function" and units["units"][j]["text"] != table["units"][i]["text"]
+                         for name in names.get(i, []) for j in units["defined"].get(name, []))}
+    failed = [func for func in funcs if conflicts & set(slice_units([func], cfg, table))]
+    funcs = [func for func in funcs if func not in failed]
+    for line in table["includes"] if funcs else []:
+        if line not in units["includes"]:
+            units["includes"].append(line)
+    for i in slice_units(funcs, cfg, table):
+        unit = table["units"][i]
+        if any(unit["kind"] == "prototype" or units["units"][j]["kind"] != "prototype"
+               for name in names.get(i, []) for j in units["defined"].get(name, [])):
+            if unit["kind"] != "prototype":
+                print("Name clash:", ", ".join(names[i]), "of", path, "left out of the slices, the one of", cfg.filename, "is used")
+            continue
+        for name in names.get(i, []):
+            units["defined"].setdefault(name, []).append(len(units["units"]))
+        units["units"].append(dict(unit, file=path, headers=table.get("headers")))
+    return failed
+
+
+def linked_files(db, path):
+    # [(file, cpp args)] of the other files defining the functions and globals the file uses, transitively.
+    # A name defined by several files is taken from the first one indexed
+    row = db.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+    if row is None:
+        return []
+    files = OrderedDict([(row[0], None)])
+    stack = [row[0]]
+    while stack:
+        file = stack.pop()
+        owners = {}
+        for name, other, other_path, file_args in db.execute(
+                "SELECT symbols.name, files.id, files.path, files.cpp_args FROM refs "
+                "JOIN symbols ON symbols.name = refs.name AND symbols.static = 0 AND symbols.name != 'main' "
+                "JOIN files ON files.id = symbols.file WHERE refs.file = ? AND symbols.file != ? ORDER BY files.id", (file, file)):
+            owners.setdefault(name, (other, other_path, file_args))
+        for other, other_path, file_args in owners.values():
+            if other not in files:
+                files[other] = (other_path, json.loads(file_args))
+                stack.append(other)
+    return [entry for entry in files.values() if entry is not None]
+
+
+def import_calls(top, cfg):
+    # adds to the tables of cfg the functions reached from top that other files define, and sets
+    # cfg.linked_files. A call of a file binds to the function of the same file first, static or not,
+    # then to the non-static ones of the source and of the index. The tables are keyed by name: a
+    # function of another file with the name of one already taken is not imported, and merge_units
+    # fails the functions that need it. The tables are copied before they change, they can be shared
+    # with the other tops of the file and the cache of --serve
+    path = os.path.realpath(cfg.filename)
+    source_static = {unit["name"] for unit in cfg.units_table["units"] if unit["kind"] == "function" and unit["static"]}
+    with open_index(cfg.index) as db:
+        imported = OrderedDict() # func -> (file id, tables, callees)
+        stack = [(top, None)] # function and file id of its caller, None for the source
+        seen = set(stack)
+        while stack:
+            func, owner = stack.pop()
+            row = None
+            if owner is not None:
+                row = db.execute("SELECT file, tables FROM functions WHERE file = ? AND name = ?", (owner, func)).fetchone()
+            if row is None and func in cfg.calls_table and (owner is None or func not in source_static):
+                callees, owner = cfg.calls_table[func], None
+            else:
+                if row is None:
+                    row = db.execute("SELECT functions.file, functions.tables FROM functions JOIN files ON files.id = functions.file "
+                                     "WHERE functions.name = ? AND files.path != ? AND functions.static = 0 "
+                                     "ORDER BY functions.file LIMIT 1", (func, path)).fetchone()
+                if row is None:
+                    continue # libc, or not in the index
+                owner = row[0]
+                if func in cfg.calls_table or imported.get(func, (owner,))[0] != owner:
+                    continue # the name is taken by another definition
+                callees = [callee for callee, in db.execute("SELECT callee FROM calls WHERE file = ? AND caller = ?", (owner, func))]
+                imported.setdefault(func, (owner, deep_loads(row[1]), callees))
+            for callee in callees:
+                if (callee, owner) not in seen:
+                    seen.add((callee, owner))
+                    stack.append((callee, owner))
+        if imported:
+            for name in ("calls_table", "params_table", "nodes_table", "params_pointers_table", "typedefs_table", "struct_decls"):
+                setattr(cfg, name, dict(getattr(cfg, name)))
+            cfg.units_table = {**cfg.units_table, "includes": list(cfg.units_table["includes"]), "units": list(cfg.units_table["units"]),
+                               "defined": {name: list(indices) for name, indices in cfg.units_table["defined"].items()}}
+            for func, (owner, tables, callees) in imported.items():
+                cfg.calls_table[func] = callees
+                cfg.params_table[func] = tables["params"]
+                cfg.nodes_table[func] = tables["node"]
+                if tables["pointers"] is not None:
+                    cfg.params_pointers_table[func] = tables["pointers"]
+            for owner in OrderedDict.fromkeys(owner for owner, _, _ in imported.values()):
+                other_path, units, types = db.execute("SELECT path, units, types FROM files WHERE id = ?", (owner,)).fetchone()
+                types = deep_loads(types)
+                for name in ("typedefs_table", "struct_decls"):
+                    for key, value in types[name].items():
+                        getattr(cfg, name).setdefault(key, value)
+                funcs = [func for func, (file, _, _) in imported.items() if file == owner]
+                for func in merge_units(cfg, json.loads(units), funcs, other_path):
+                    print("Cannot import", func, "from", other_path + ": it needs a function whose name another file defines")
+                    for name in ("calls_table", "params_table", "nodes_table", "params_pointers_table"):
+                        getattr(cfg, name).pop(func, None)
+                    funcs.remove(func)
+                if funcs:
+                    print("Imported", ", ".join(funcs), "from", other_path)
+            cfg.call_graph = None
+        cfg.linked_files = linked_files(db, path)
+
+
+########################################################################################
+#                                       BATCH                                          #
+########################################################################################
+# many files and top functions in one run. The entries come from a json manifest:
+#   [{"file": "src/a.c", "top": "f" or ["f", "g"], "cpp_args": ["-Iinclude", "-DX=1"]}, ...]
+# with paths relative to the manifest (see rebase_args), or from a compile_commands.json, whose -I/-D/-U are kept.
+# Without a top, the roots of the call graph (functions called only by main, or not at all) are used.
+# The parse and build caches and the worker pool are shared, each file and top gets its own
+# folder in tmp_folder and index.json lists the outputs of every entry
+def prepare(cfg):
+    # capture stage of one file and top, the source is already parsed
+    if cfg.index:
+        with cfg.profiler.stage("index"), open_index(cfg.index) as db:
+            if index_stale(db, cfg):
+                index_file(db, cfg)
+    with cfg.profiler.stage("explore"):
+        explore_calls(cfg.top, cfg.hierarchical_calls, cfg)
+    with cfg.profiler.stage("manifest"):
+        manifest, hashes, stale = load_manifest(cfg)
+    captures = None
+    if not stale:
+        print("All tests are up to date")
+    elif cfg.capture == "native":
+        captures = capture_native(stale, cfg, "native")
+    elif cfg.capture in ("session", "checkpoint"):
+        build_binary(cfg)
+        captures = capture_workloads(lambda folder, workload: capture(stale, cfg, cfg.capture, folder, workload, cfg.capture == "checkpoint"), cfg, stale)
+    else:
+        build_binary(cfg)
+        captures = None # each worker captures its function
+    return manifest, hashes, stale, captures
+
+
+# options of cpp whose value is a path, relative to the working directory
+path_options = ("-I", "-include", "-imacros", "-iquote", "-isystem", "-idirafter")
+
+def rebase_args(directory, args):
+    # args with the paths of path_options resolved against directory instead of the working directory
+    rebased = []
+    args = iter(args)
+    for arg in args:
+        option = next((option for option in path_options if arg.startswith(option)), None)
+        if option is None:
+            rebased.append(arg)
+        elif arg == option:
+            rebased += [arg, os.path.join(directory, next(args, ""))]
+        else:
+            rebased.append(option + os.path.join(directory, arg[len(option):]))
+    return rebased
+
+
+def command_args(directory, arguments):
+    # the preprocessor options of a compile command, include paths made absolute
+    args = []
+    arguments = iter(arguments)
+    for arg in arguments:
+        if arg in ("-I", "-D", "-U", "-include"):
+            value = next(arguments, "")
+        elif arg[:2] in ("-I", "-D", "-U"):
+            arg, value = arg[:2], arg[2:]
+        else:
+            continue
+        args += [arg, value] if arg == "-include" else [arg + value]
+    return rebase_args(directory, args)
+
+
+def load_batch(path, compile_commands=False):
+    # returns [(file, tops or None, cpp args)]
+    with open(path) as f:
+        entries = json.load(f)
+    batch = []
+    base = os.path.dirname(os.path.abspath(path))
+    for entry in entries:
+        if compile_commands:
+            directory = os.path.join(base, entry.get("directory", "."))
+            arguments = entry["arguments"] if "arguments" in entry else entry["command"].split()
+            batch.append((os.path.join(directory, entry["file"]), None, command_args(directory, arguments[1:])))
+        else:
+            tops = entry.get("top")
+            tops = [tops] if isinstance(tops, str) else tops
+            batch.append((os.path.join(base, entry["file"]), tops, rebase_args(base, entry.get("cpp_args", []))))
+    return batch
+
+
+def root_functions(cfg):
+    graph = call_graph(cfg)
+    return [func for func in cfg.calls_table if func != "main" and all(caller == "main" for caller in graph.callers(func))]
+
+
+def batch_cfg(args, filename, top, folder, file_args, profiler):
+    cfg = CFG(argparse.Namespace(**dict(vars(args), file=filename, top=top, tmp_folder=folder, cache_folder=args.tmp_folder)))
+    cfg.cpp_args = [cpp_args, *file_args]
+    cfg.profiler = profiler
+    return cfg
+
+
+def run_batch(args, batch):
+    profiler = Profiler(args.profile)
+    if args.index:
+        # every file of the batch is indexed first, the unchanged ones are not parsed
+        with profiler.stage("index"), open_index(args.index) as db:
+            for filename, _, file_args in batch:
+                parsed = batch_cfg(args, filename, None, args.tmp_folder, file_args, profiler)
+                try:
+                    if index_stale(db, parsed):
+                        parse_source(parsed)
+                        index_file(db, parsed)
+                except Exception as e:
+                    print("Failed to index", filename, ":", e)
+    if args.file:
+        # the batch only gives the project, tests are generated for --file
+        batch = [(filename, [args.top] if args.top else tops, file_args) for filename, tops, file_args in batch
+                 if os.path.realpath(filename) == os.path.realpath(args.file)]
+        if not batch:
+            print(args.file, "is not in", args.batch or args.compile_commands)
+    index = []
+    entries = []
+    # the folders are named after the path of the file relative to the manifest
+    base = os.path.dirname(os.path.abspath(args.batch or args.compile_commands))
+    for filename, tops, file_args in batch:
+        name = os.path.splitext(os.path.relpath(filename, base))[0].replace(os.sep, "_").replace(".", "_")
+        try:
+            parsed = batch_cfg(args, filename, None, f"{args.tmp_folder}{name}/", file_args, profiler)
+            parse_source(parsed)
+            if not tops:
+                tops = root_functions(parsed)
+                print("Top functions of", filename, ":", ", ".join(tops))
+        except Exception as e:
+            print("Failed", filename, ":", e)
+            index.append({"file": filename, "top": tops, "error": str(e)})
+            continue
+        for top in tops:
+            cfg = batch_cfg(args, filename, top, f"{args.tmp_folder}{name}/{top}/", file_args, profiler)
+            # the tops of a file share its tables
+            for table in parse_tables:
+                setattr(cfg, table, getattr(parsed, table))
+            cfg.call_graph = call_graph(parsed)
+            try:
+                entries.append((cfg, *prepare(cfg)))
+            except Exception as e:
+                print("Failed", filename, top, ":", e)
+                index.append({"file": filename, "top": top, "error": str(e)})
+
+    stale_entries = [entry for entry in entries if entry[3]]
+    results = generate_batch([(cfg, captures, stale) for cfg, _, _, stale, captures in stale_entries], args.jobs or os.cpu_count() or 1)
+    results = iter(results) # in the order of stale_entries
+    for cfg, manifest, hashes, stale, _ in entries:
+        entry_results = next(results) if stale else None
+        index.append({"file": cfg.filename, "top": cfg.top, "folder": cfg.tmp_folder, "regenerated": stale})
+        try:
+            if entry_results is not None:
+                save_manifest(cfg, manifest, hashes, entry_results)
+            index[-1].update(functions={func: manifest["functions"][func]["outputs"] for func in cfg.hierarchical_calls if func in manifest["functions"]},
+                             errors={func: record["error"] for func, record in manifest["functions"].items() if "error" in record})
+            if cfg.validate:
+                summary = validate(cfg, manifest)
+                index[-1]["validation"] = {"passed": summary["passed"], "failed": summary["failed"], "unchecked": summary["unchecked"]}
+        except Exception as e:
+            # the other entries go on
+            print("Failed", cfg.filename, cfg.top, ":", e)
+            index[-1]["error"] = str(e)
+    with open(f"{args.tmp_folder}index.json", "w") as f:
+        json.dump(index, f, indent=1)
+    print("Results index written to", f"{args.tmp_folder}index.json")
+    profiler.write()
+
+
+########################################################################################
+#                                       SERVE                                          #
+########################################################################################
+# --serve: long running generator for editors and hooks. Requests are json lines on a unix socket,
+#   {"file": "src/a.c", "top": "f", "cpp_args": [...], "force": false, ...}
+# with the same options as the command line, answered by one json line with the folder of the
+# tests and the functions that were regenerated. The parsed files stay in memory and are parsed
+# again when the file or one of the headers it includes changes (mtime, see source_dependencies),
+# the manifest of each file and top regenerates only the functions that changed. Session captures run in warm gdb processes
+# choices of the options, checked like argparse does for the requests
+option_choices = {"capture": ["session", "checkpoint", "function", "native"], "sampling": ["stride", "reservoir"]}
+request_options = ["capture", "invocations", "sampling", "stride", "seed", "inline_limit", "verbose_tests", "graph_depth", "graph_budget", "stage_timeout", "memory_limit", "workloads", "force", "tmp_folder", "validate"]
+
+class GdbPool:
+    # gdb processes started once, captures source their script in them
+    sentinel = "__utg_capture_done__"
+
+    def __init__(self, size):
+        import queue
+        self.owner = os.getpid()
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(self.start())
+
+    def start(self):
+        # long lived and interactive, the one process not started with run_process
+        p = subprocess.Popen(["gdb", "-q", "-nx"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             bufsize=1, text=True, errors="replace", start_new_session=True)
+        p.stdin.write("set pagination off\n")
+        return p
+
+    def run(self, script, log, timeout=None, memory_limit=None):
+        # streams the output of the capture to log, returns ok, timeout or memory like run_process,
+        # whose limits are polled the same way while the capture runs
+        p = self.idle.get()
+        killed = [] # status of the watcher when it killed p
+        done = threading.Event()
+        def watch():
+            deadline = time.monotonic() + timeout if timeout else None
+            while not done.wait(0.1):
+                if deadline is not None and time.monotonic() > deadline:
+                    killed.append("timeout")
+                elif memory_limit and process_rss(p.pid) > memory_limit:
+                    killed.append("memory")
+                else:
+                    continue
+                kill_process(p)
+                return
+        watcher = None
+        try:
+            if p.poll() is not None:
+                p = self.start()
+            if timeout or memory_limit:
+                watcher = threading.Thread(target=watch, daemon=True)
+                watcher.start()
+            p.stdin.write(f"source {script}\necho {self.sentinel}\\n\n")
+            p.stdin.flush()
+            with open(log, "w") as f:
+                for line in p.stdout:
+                    if self.sentinel in line:
+                        return "ok"
+                    f.write(line)
+            p.wait()
+            if killed:
+                return killed[0]
+            raise RuntimeError("gdb exited during the capture")
+        except Exception:
+            kill_process(p)
+            p.wait()
+            raise
+        finally:
+            done.set()
+            if watcher is not None:
+                watcher.join()
+            if p.poll() is not None:
+                p = self.start()
+            self.idle.put(p)
+
+    def close(self):
+        while not self.idle.empty():
+            p = self.idle.get()
+            if p.poll() is None:
+                p.stdin.write("quit\n")
+                p.stdin.close()
+                p.wait()
+
+
+class GenerationServer:
+    # state of --serve shared by the request threads, the socket server is made by serve
+    def __init__(self, args):
+        self.args = args
+        self.parsed = {} # (file, cpp args) -> (mtimes of the file and of the headers it includes, parsed cfg)
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.generate_lock = threading.Lock() # generate_all forks from worker_state, one at a time
+        self.gdb_pool = GdbPool(args.gdb_pool) if shutil.which("gdb") and args.gdb_pool > 0 else None
+
+    def key_lock(self, key):
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def parsed_cfg(self, args, file_args):
+        key = (os.path.realpath(args.file), tuple(file_args))
+        with self.key_lock(key):
+            mtimes, parsed = self.parsed.get(key, (None, None))
+            if mtimes is not None:
+                for path, mtime in mtimes.items():
+                    if not os.path.exists(path) or os.stat(path).st_mtime_ns != mtime:
+                        print("Changed", path, "parsing", args.file, "again", flush=True)
+                        parsed = None
+                        break
+            if parsed is None:
+                parsed = CFG(args)
+                parsed.cpp_args = [cpp_args, *file_args]
+                parse_source(parsed)
+                call_graph(parsed)
+                files, _ = source_dependencies(args.file, parsed.cpp_args, parsed)
+                self.parsed[key] = ({path: os.stat(path).st_mtime_ns for path in files}, parsed)
+            return parsed
+
+    def generate(self, request):
+        start = time.perf_counter()
+        if "file" not in request or "top" not in request:
+            raise ValueError("file and top are required")
+        options = {name: request[name] for name in request_options if name in request}
+        for name, choices in option_choices.items():
+            if name in options and options[name] not in choices:
+                raise ValueError(f"invalid {name}: {options[name]!r} (choose from {', '.join(choices)})")
+        args = argparse.Namespace(**dict(vars(self.args), file=request["file"], top=request["top"], **options))
+        if not args.tmp_folder.endswith("/"):
+            args.tmp_folder += "/"
+        if "tmp_folder" not in request:
+            name = os.path.splitext(os.path.relpath(args.file))[0].replace(os.sep, "_").replace(".", "_")
+            args.tmp_folder = f"{self.args.tmp_folder}{name}/{args.top}/"
+            args.cache_folder = self.args.tmp_folder
+        parsed = self.parsed_cfg(args, request.get("cpp_args", []))
+        with self.key_lock((args.tmp_folder,)):
+            cfg = CFG(args)
+            cfg.cpp_args = parsed.cpp_args
+            cfg.gdb_pool = self.gdb_pool
+            for table in parse_tables:
+                setattr(cfg, table, getattr(parsed, table))
+            cfg.call_graph = parsed.call_graph
+            if args.top not in cfg.calls_table:
+                raise ValueError(f"{args.top} is not defined in {args.file}")
+            manifest, hashes, stale, captures = prepare(cfg)
+            if stale:
+                with self.generate_lock:
+                    results = generate_all(cfg, captures, stale)
+                save_manifest(cfg, manifest, hashes, results)
+            response = {"ok": True, "folder": cfg.tmp_folder, "regenerated": stale,
+                        "functions": {func: manifest["functions"][func]["outputs"] for func in cfg.hierarchical_calls if func in manifest["functions"]},
+                        "errors": {func: entry["error"] for func, entry in manifest["functions"].items() if "error" in entry}}
+            if cfg.validate:
+                response["validation"] = validate(cfg, manifest)
+        response["elapsed_s"] = round(time.perf_counter() - start, 3)
+        return response
+
+    def close(self):
+        cancel_processes()
+        if self.gdb_pool is not None:
+            self.gdb_pool.close()
+
+
+def serve(args):
+    import socketserver
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    response = generator.generate(json.loads(line))
+                except Exception as e:
+                    response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                self.wfile.write((json.dumps(response) + "\n").encode())
+                self.wfile.flush()
+
+    generator = GenerationServer(args)
+    if os.path.exists(args.serve):
+        os.remove(args.serve)
+    with Server(args.serve, Handler) as server:
+        print("Serving on", args.serve, flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(args.serve)
+            generator.close()
+
+
+def request(path, request):
+    # client side of --serve, returns the response
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall((json.dumps(request) + "\n").encode())
+        return json.loads(s.makefile().readline())
+
 
 # main
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Automatic Unit Test Generator for C Programs.\nUsage: python gen.py -f <file.c> -t <tmp_folder>')
-    parser.add_argument('-f', '--file', type=str, help='C file to generate unit tests for', required=True)
-    parser.add_argument('-t', '--top', type=str, help='Top Function: function for which a test is provided', required=True)
+    parser.add_argument('-f', '--file', type=str, help='C file to generate unit tests for', required=False)
+    parser.add_argument('-t', '--top', type=str, help='Top Function: function for which a test is provided', required=False)
     parser.add_argument('--tmp_folder', type=str, default="tmp/", help='Temporary folder to store files', required=False)
+    parser.add_argument('--capture', type=str, default="session", choices=option_choices["capture"], help='session: one gdb run captures all the functions, checkpoint: one pass per function resumed from a gdb checkpoint at the first call of the top function, function: one gdb run per function, native: instrumented build without gdb', required=False)
+    parser.add_argument('--invocations', type=int, default=1, help='Number of calls captured per function, one test per distinct input', required=False)
+    parser.add_argument('--sampling', type=str, default="stride", choices=option_choices["sampling"], help='stride: every --stride calls from the first one, reservoir: uniform sample over all the calls', required=False)
+    parser.add_argument('--stride', type=int, default=1, help='Calls between two captured calls with --sampling stride', required=False)
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the reservoir sampling', required=False)
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Worker processes generating tests in parallel, one per core by default', required=False)
+    parser.add_argument('--force', action='store_true', help='Regenerate the tests of all the functions, also the unchanged ones', required=False)
+    parser.add_argument('--verbose_tests', action='store_true', help='The tests also print every parameter and buffer after the call, as before the memcmp checks', required=False)
+    parser.add_argument('--graph_depth', type=int, default=2, help='Levels of pointers followed from the buffers of the pointer parameters, 0 captures only the buffers', required=False)
+    parser.add_argument('--graph_budget', type=int, default=1 << 20, help='Bytes captured per call for the objects reached through pointers', required=False)
+    parser.add_argument('--workloads', type=str, default=None, help='JSON list of runs of the program to capture, each with its own args, stdin, env and cwd, captured in parallel and merged', required=False)
+    parser.add_argument('--inline_limit', type=int, default=4096, help='Buffers larger than this many bytes are written to a .bin file loaded by the test instead of a C initializer', required=False)
+    parser.add_argument('--batch', type=str, default=None, help='JSON manifest of the files, top functions and cpp args to process in one run', required=False)
+    parser.add_argument('--compile_commands', type=str, default=None, help='compile_commands.json of the files to process in one run, with the roots of their call graphs as tops', required=False)
+    parser.add_argument('--index', type=str, default=None, help='SQLite index of the functions, signatures and call edges of the files of the project, used to follow calls into other files', required=False)
+    parser.add_argument('--serve', type=str, default=None, help='Serve generation requests on this unix socket, keeping the parsed files and gdb sessions warm', required=False)
+    parser.add_argument('--gdb_pool', type=int, default=2, help='Warm gdb processes kept by --serve', required=False)
+    parser.add_argument('--connect', type=str, default=None, help='Send --file and --top to the server listening on this unix socket', required=False)
+    parser.add_argument('--validate', action='store_true', help='Build and run the generated tests and compare their output with the state recorded after each call', required=False)
+    parser.add_argument('--stage_timeout', type=float, default=600, help='Seconds after which a compiler, gdb or program run is killed, the calls captured so far are kept', required=False)
+    parser.add_argument('--memory_limit', type=int, default=0, help='MB of resident memory, summed over a process and its children, above which it is killed; 0 for no limit', required=False)
+    parser.add_argument('--timeout', type=float, default=10, help='Seconds a test can run with --validate', required=False)
+    parser.add_argument('--profile', type=str, default=None, help='Write the time and memory of each stage to this file, as a chrome trace', required=False)
     args = parser.parse_args()
 
-    cfg = CFG(args)
+    if not args.tmp_folder.endswith("/"):
+        args.tmp_folder += "/"
+    if args.batch or args.compile_commands:
+        run_batch(args, load_batch(args.batch or args.compile_commands, compile_commands=args.batch is None))
+        sys.exit(0)
+    if args.serve:
+        serve(args)
+        sys.exit(0)
+    if not args.file or not args.top:
+        parser.error("--file and --top are required without --batch, --compile_commands or --serve")
+    if args.connect:
+        response = request(args.connect, {"file": os.path.abspath(args.file), "top": args.top, "force": args.force})
+        print(json.dumps(response, indent=1))
+        sys.exit(0 if response["ok"] else 1)
 
-    ast = parse_file(cfg.filename, use_cpp=True, cpp_args=r'-Iutils/fake_libc_include')
-    v = HierarchyVisitor(cfg)
-    v.visit(ast)
-    explore_calls(cfg.top, cfg.hierarchical_calls, cfg)
-    for func in cfg.hierarchical_calls:
-        build_unit_test(func, cfg)
-    
\ No newline at end of file
+    cfg = CFG(args)
+    if cfg.index:
+        # the cpp args of a file indexed from a batch or a compile_commands.json
+        with open_index(cfg.index) as db:
+            row = db.execute("SELECT cpp_args FROM files WHERE path = ?", (os.path.realpath(cfg.filename),)).fetchone()
+        cfg.cpp_args = [cpp_args, *json.loads(row[0])] if row is not None else cfg.cpp_args
+    parse_source(cfg)
+    manifest, hashes, stale, captures = prepare(cfg)
+    if stale:
+        save_manifest(cfg, manifest, hashes, generate_all(cfg, captures, stale))
+    if cfg.validate:
+        validate(cfg, manifest)
+    cfg.profiler.write()
@@ -0,0 +1,550 @@
+#-----------------------------------------------------------------
+# Tests of the parts of generate_unit_tests.py that run without
+# clang or gdb. The ones that preprocess sources need cpp.
+#
+# Usage: python -m pytest tests/ (from the root of the repository)
+#-----------------------------------------------------------------
+import argparse
+import collections
+import json
+import math
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import time
+import types
+
+import pytest
+from pycparser import c_ast, c_generator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import generate_unit_tests as gut
+
+
+def u64s(*values):
+    return struct.pack(f"={len(values)}Q", *values)
+
+
+def trace_cfg():
+    # load_trace only needs the parameter names of each function
+    return types.SimpleNamespace(params_table={"f": [(None, "buf"), (None, "n")]})
+
+
+def call(hit, buf, n):
+    # C, the pointer buf as 4 byte signed ints, the int n, E
+    return (b"C" + u64s(0, 0, hit)
+            + b"P" + u64s(0, 0x1000, 0, len(buf), 4, 3) + buf
+            + b"V" + u64s(1, 4, 1) + struct.pack("=i", n) + u64s(0, 4, 1, 3)
+            + b"E")
+
+
+def post(hit, buf, ret):
+    # R, the buffer after the call and the int return value
+    return b"R" + u64s(0, 0, hit, 1) + u64s(0, len(buf)) + buf + u64s(3, 4) + struct.pack("=i", ret)
+
+
+def load(tmp_path, data):
+    path = tmp_path / "trace.bin"
+    path.write_bytes(data)
+    return gut.load_trace(str(path), ["f"], trace_cfg(), {"f": {"n": ("scalar", None)}})
+
+
+def test_load_trace_round_trip(tmp_path):
+    before, after = struct.pack("=2i", 1, -2), struct.pack("=2i", 2, -4)
+    captures = load(tmp_path, call(1, before, -7) + post(1, after, 42))
+    params = captures["f"][0]
+    assert bytes(params["buf"]["data"]) == before
+    assert bytes(params["buf"]["post"]) == after
+    assert (params["buf"]["elem_size"], params["buf"]["scalar"], params["buf"]["signed"]) == (4, True, True)
+    assert params["n"] == {"func": "f", "param": "n", "kind": "value", "value": -7}
+    assert params["return"]["value"] == 42
+
+
+def test_load_trace_ignores_the_return_of_a_replaced_call(tmp_path):
+    # the second call takes slot 0, the state after the first one belongs to no test
+    first, second = struct.pack("=2i", 1, 1), struct.pack("=2i", 3, 3)
+    captures = load(tmp_path, call(1, first, 1) + call(2, second, 2) + post(1, first, 5))
+    params = captures["f"][0]
+    assert params["n"]["value"] == 2
+    assert "post" not in params["buf"] and "return" not in params
+
+
+def test_load_trace_keeps_the_calls_of_a_truncated_trace(tmp_path):
+    data = call(1, struct.pack("=2i", 1, 2), 3) + post(1, struct.pack("=2i", 2, 4), 6)
+    captures = load(tmp_path, data[:-3])
+    params = captures["f"][0]
+    assert params["n"]["value"] == 3
+    assert "return" not in params
+
+
+def test_call_graph_sccs_and_reachability():
+    graph = gut.CallGraph({"a": ["b", "c"], "b": ["c", "a"], "c": ["d", "printf"], "d": [], "e": ["d"]})
+    components = [sorted(component) for component in graph.sccs()]
+    assert sorted(components) == [["a", "b"], ["c"], ["d"], ["e"]]
+    # callees first
+    assert components.index(["d"]) < components.index(["c"]) < components.index(["a", "b"])
+    assert graph.reachable("a", "d") and graph.reachable("b", "a")
+    assert not graph.reachable("d", "a") and not graph.reachable("e", "c")
+    assert not graph.reachable("a", "printf")
+    assert graph.reachable_from("c") == {"c", "d"}
+    assert graph.reachable_from("a") == {"a", "b", "c", "d"}
+    assert graph.recursive("a") and not graph.recursive("c")
+    closure = graph.closure("a")
+    assert closure[-1] == "a" and closure.index("d") < closure.index("c")
+    assert graph.callers("d") == ["c", "e"]
+
+
+project = {
+    "util.h": """
+int checksum(const unsigned char *buf, int n);
+void scale(unsigned char *buf, int n);
+""",
+    "util.c": """
+#include "util.h"
+static int clamp(int v) { return v < 0 ? 0 : v; }
+static int twice(int v) { return 2 * v; }
+int checksum(const unsigned char *buf, int n) { int i, s = 0; for (i = 0; i < n; i++) s += twice(buf[i]); return s; }
+void scale(unsigned char *buf, int n) { int i; for (i = 0; i < n; i++) buf[i] = clamp(buf[i] - 1); }
+""",
+    "main.c": """
+#include "util.h"
+static int clamp(int v) { return v > 100 ? 100 : v; }
+int process(unsigned char *buf, int n) { scale(buf, n); return checksum(buf, n) + clamp(n); }
+int main(void) { unsigned char b[4] = {1, 2, 3, 4}; return process(b, 4); }
+""",
+}
+
+
+def project_cfg(tmp_path, filename, top=None):
+    cfg = gut.CFG(argparse.Namespace(tmp_folder=f"{tmp_path}/out/", top=top, file=str(tmp_path / filename), index=str(tmp_path / "index.db")))
+    cfg.cpp_args = [gut.cpp_args, f"-I{tmp_path}"]
+    gut.parse_source(cfg)
+    return cfg
+
+
+@pytest.mark.skipif(shutil.which("cpp") is None, reason="the sources are preprocessed with cpp")
+def test_import_calls_resolves_static_functions_by_file(tmp_path):
+    for name, text in project.items():
+        (tmp_path / name).write_text(text)
+    for name in ("main.c", "util.c"):
+        cfg = project_cfg(tmp_path, name)
+        with gut.open_index(cfg.index) as db:
+            gut.index_file(db, cfg)
+
+    cfg = project_cfg(tmp_path, "main.c", "process")
+    gut.import_calls("process", cfg)
+    # the static helper of util.c with a name of its own is imported with its caller
+    assert "checksum" in cfg.nodes_table and "twice" in cfg.nodes_table
+    assert cfg.nodes_table["twice"].coord.file.endswith("util.c")
+    # scale needs the clamp of util.c, main.c has its own: scale is not imported
+    assert "scale" not in cfg.nodes_table
+    assert cfg.nodes_table["clamp"].coord.file.endswith("main.c")
+    imported = {unit["name"] for unit in cfg.units_table["units"] if unit.get("file")}
+    assert {"checksum", "twice"} <= imported and "clamp" not in imported
+    assert [os.path.basename(path) for path, _ in cfg.linked_files] == ["util.c"]
+
+
+def write_files(folder, files):
+    for name, text in files.items():
+        os.makedirs(os.path.dirname(folder / name), exist_ok=True)
+        (folder / name).write_text(text)
+
+
+def source_cfg(tmp_path, filename, *file_args, top=None):
+    cfg = gut.CFG(argparse.Namespace(tmp_folder=f"{tmp_path}/out/", top=top, file=str(tmp_path / filename)))
+    cfg.cpp_args = [gut.cpp_args, *file_args]
+    return cfg
+
+
+scaled = {
+    "include/cfg.h": "#define SCALE 2\n",
+    "a.c": '#include "cfg.h"\nint f(int x) { return x * SCALE; }\nint main(void) { return f(1); }\n',
+}
+
+
+@pytest.mark.skipif(shutil.which("cpp") is None, reason="the sources are preprocessed with cpp")
+def test_source_dependencies_follow_the_include_paths(tmp_path):
+    write_files(tmp_path, dict(scaled, **{"forced.h": ""}))
+    cfg = source_cfg(tmp_path, "a.c", f"-I{tmp_path}/include", "-include", f"{tmp_path}/forced.h")
+    files, digest = gut.source_dependencies(cfg.filename, cfg.cpp_args[1:], cfg)
+    assert files == [str(tmp_path / "a.c"), str(tmp_path / "forced.h"), str(tmp_path / "include/cfg.h")]
+    assert digest == gut.files_digest(files)
+    # the list of the first run is reused
+    assert os.listdir(f"{cfg.cache_folder}deps")
+    assert gut.source_dependencies(cfg.filename, cfg.cpp_args[1:], cfg) == (files, digest)
+
+
+@pytest.mark.skipif(shutil.which("cpp") is None, reason="the sources are preprocessed with cpp")
+def test_parse_cache_is_invalidated_by_a_header_on_the_include_path(tmp_path, capsys):
+    write_files(tmp_path, scaled)
+    cfg = source_cfg(tmp_path, "a.c", f"-I{tmp_path}/include")
+    key = gut.parse_key(cfg)
+    gut.parse_source(cfg)
+    cfg = source_cfg(tmp_path, "a.c", f"-I{tmp_path}/include")
+    assert gut.parse_key(cfg) == key
+    gut.parse_source(cfg)
+    assert "Using cached parse" in capsys.readouterr().out
+
+    (tmp_path / "include/cfg.h").write_text("#define SCALE 5\n")
+    cfg = source_cfg(tmp_path, "a.c", f"-I{tmp_path}/include")
+    assert gut.parse_key(cfg) != key
+    gut.parse_source(cfg)
+    assert "Using cached parse" not in capsys.readouterr().out
+    assert "x * 5" in gut.sliced_source(["f"], cfg)
+
+
+@pytest.mark.skipif(shutil.which("cpp") is None or not (shutil.which("clang") or shutil.which("gcc")), reason="needs cpp and a compiler")
+def test_build_cache_is_invalidated_by_a_header_on_the_include_path(tmp_path, capsys, monkeypatch):
+    if not shutil.which(gut.compiler):
+        monkeypatch.setattr(gut, "compiler", "gcc")
+    write_files(tmp_path, scaled)
+    cfg = source_cfg(tmp_path, "a.c", f"-I{tmp_path}/include")
+    binary = gut.build_binary(cfg, flags=["-c"], output="a.o")
+    assert gut.build_binary(cfg, flags=["-c"], output="a.o") == binary
+    assert "Using cached build" in capsys.readouterr().out
+
+    (tmp_path / "include/cfg.h").write_text("#define SCALE 5\n")
+    assert gut.build_binary(cfg, flags=["-c"], output="a.o") != binary
+    assert "Using cached build" not in capsys.readouterr().out
+
+
+layered = {
+    "include/cfg.h": "#define SCALE 2\nstruct pair { int a, b; };\n",
+    "a.c": """#include "cfg.h"
+int g(int x) { return x + 1; }
+int f(int x) { return g(x) * SCALE; }
+int h(struct pair *p) { return p->a; }
+int top(struct pair *p) { return f(p->b) + h(p); }
+int main(void) { struct pair p = {1, 2}; return top(&p); }
+""",
+}
+
+
+def manifest_run(tmp_path):
+    # the manifest stage of a run on top, with an empty test per regenerated function
+    cfg = source_cfg(tmp_path, "a.c", f"-I{tmp_path}/include", top="top")
+    gut.parse_source(cfg)
+    gut.explore_calls(cfg.top, cfg.hierarchical_calls, cfg)
+    manifest, hashes, stale = gut.load_manifest(cfg)
+    for func in stale:
+        (tmp_path / "out" / f"{func}_test.c").write_text("")
+    gut.save_manifest(cfg, manifest, hashes, [(func, None, [f"{func}_test.c"], None) for func in stale])
+    return sorted(stale)
+
+
+@pytest.mark.skipif(shutil.which("cpp") is None, reason="the sources are preprocessed with cpp")
+def test_manifest_regenerates_only_the_changed_slices(tmp_path):
+    write_files(tmp_path, layered)
+    assert manifest_run(tmp_path) == ["f", "g", "h", "top"]
+    assert manifest_run(tmp_path) == []
+
+    # g is in the slices of f and top
+    (tmp_path / "a.c").write_text(layered["a.c"].replace("x + 1", "x + 2"))
+    assert manifest_run(tmp_path) == ["f", "g", "top"]
+    # a missing output is generated again
+    os.remove(tmp_path / "out" / "h_test.c")
+    assert manifest_run(tmp_path) == ["h"]
+    # the headers found through -I are in every slice
+    (tmp_path / "include/cfg.h").write_text(layered["include/cfg.h"].replace("int a, b", "long a, b"))
+    assert manifest_run(tmp_path) == ["f", "g", "h", "top"]
+    assert manifest_run(tmp_path) == []
+
+
+@pytest.mark.skipif(shutil.which("cpp") is None, reason="the sources are preprocessed with cpp")
+def test_manifest_regenerates_the_functions_that_failed(tmp_path):
+    write_files(tmp_path, layered)
+    cfg = source_cfg(tmp_path, "a.c", f"-I{tmp_path}/include", top="h")
+    gut.parse_source(cfg)
+    gut.explore_calls(cfg.top, cfg.hierarchical_calls, cfg)
+    manifest, hashes, stale = gut.load_manifest(cfg)
+    gut.save_manifest(cfg, manifest, hashes, [("h", None, [], "gdb killed")])
+    assert gut.load_manifest(cfg)[2] == ["h"]
+
+
+@pytest.mark.skipif(shutil.which("cpp") is None, reason="the sources are preprocessed with cpp")
+def test_serve_parses_again_after_a_header_change(tmp_path):
+    write_files(tmp_path, scaled)
+    server = gut.GenerationServer(argparse.Namespace(tmp_folder=f"{tmp_path}/out/", gdb_pool=0))
+    args = argparse.Namespace(tmp_folder=f"{tmp_path}/out/", top="f", file=str(tmp_path / "a.c"))
+    parsed = server.parsed_cfg(args, [f"-I{tmp_path}/include"])
+    assert server.parsed_cfg(args, [f"-I{tmp_path}/include"]) is parsed
+
+    (tmp_path / "include/cfg.h").write_text("#define SCALE 5\n")
+    os.utime(tmp_path / "include/cfg.h", ns=(0, 0))
+    parsed = server.parsed_cfg(args, [f"-I{tmp_path}/include"])
+    assert "x * 5" in gut.sliced_source(["f"], parsed)
+
+
+def test_batch_paths_are_relative_to_the_manifest(tmp_path):
+    (tmp_path / "proj").mkdir()
+    (tmp_path / "proj/manifest.json").write_text(json.dumps([{"file": "src/a.c", "top": "f",
+        "cpp_args": ["-Iinclude", "-I", "gen", "-include", "cfg.h", "-iquotequote", f"-I{tmp_path}/abs", "-DX=1"]}]))
+    base = str(tmp_path / "proj")
+    assert gut.load_batch(str(tmp_path / "proj/manifest.json")) == [(f"{base}/src/a.c", ["f"],
+        [f"-I{base}/include", "-I", f"{base}/gen", "-include", f"{base}/cfg.h", f"-iquote{base}/quote", f"-I{tmp_path}/abs", "-DX=1"])]
+
+
+def test_compile_commands_keep_the_preprocessor_options(tmp_path):
+    (tmp_path / "compile_commands.json").write_text(json.dumps([{"directory": "build", "file": "../a.c",
+        "arguments": ["cc", "-c", "-Iinc", "-D", "X=1", "-O2", "-include", "cfg.h", "-UY", "../a.c"]}]))
+    build = str(tmp_path / "build")
+    assert gut.load_batch(str(tmp_path / "compile_commands.json"), compile_commands=True) == [(f"{build}/../a.c", None,
+        [f"-I{build}/inc", "-DX=1", "-include", f"{build}/cfg.h", "-UY"])]
+
+
+def test_decode_uses_the_element_type():
+    data = struct.pack("=4h", -1, 2, -3, 4) + b"\x01" # a trailing partial element is dropped
+    assert list(gut.decode(data, 2, True, False)) == [-1, 2, -3, 4]
+    assert list(gut.decode(data, 2, False, False)) == [65535, 2, 65533, 4]
+    assert list(gut.decode(struct.pack("=2q", -2**63, 2**63 - 1), 8, True, False)) == [-2**63, 2**63 - 1]
+    assert list(gut.decode(struct.pack("=Q", 2**64 - 1), 8, False, False)) == [2**64 - 1]
+    values = gut.decode(struct.pack("=3d", float("nan"), float("inf"), -0.5), 8, True, True)
+    assert values[0] != values[0] and list(values[1:]) == [float("inf"), -0.5]
+    # sizes without a memoryview format
+    assert gut.decode(b"\xff\xff\xff\x01\x00\x00", 3, True, False) == [-1, 1]
+
+
+def test_c_literal_of_the_special_values():
+    assert [gut.c_literal(value) for value in (float("nan"), float("inf"), float("-inf"), 0.1, -2.0)] == \
+        ["NAN", "INFINITY", "-INFINITY", "0.1", "-2.0"]
+    assert gut.c_literal(2**64 - 1) == "18446744073709551615ULL"
+    assert gut.c_literal(2**63) == "9223372036854775808ULL"
+    assert gut.c_literal(2**63 - 1) == "9223372036854775807"
+    assert gut.c_literal(-2**63) == "(-0x7fffffffffffffffLL - 1)"
+    assert gut.c_literal(-2**63 + 1) == "-9223372036854775807"
+
+
+def rendered(values, fmt=gut.c_literal, c_type="double", name="x"):
+    decl = c_ast.Decl(name, [], [], [], [], c_ast.ArrayDecl(c_ast.TypeDecl(name, [], None, c_ast.IdentifierType(c_type.split())), None, []),
+                      gut.bulk_initializer(values, fmt), None)
+    return c_generator.CGenerator().visit(decl)
+
+
+def test_bulk_initializer_is_one_node():
+    init = gut.bulk_initializer(bytes(range(256)) * 4)
+    assert isinstance(init, c_ast.InitList) and len(init.exprs) == 1
+    assert rendered(b"\x00\x07\xff", c_type="unsigned char") == "unsigned char x[] = {0, 7, 255}"
+    assert rendered(memoryview(b"\x00\x07\xff"), str, "unsigned char") == "unsigned char x[] = {0, 7, 255}"
+    assert rendered([float("nan"), float("-inf"), 0.5]) == "double x[] = {NAN, -INFINITY, 0.5}"
+    assert rendered([-2**63, 2**63 - 1], c_type="long long") == "long long x[] = {(-0x7fffffffffffffffLL - 1), 9223372036854775807}"
+    assert rendered(memoryview(struct.pack("=Q", 2**64 - 1)).cast("Q"), "%#xULL".__mod__, "unsigned long long") == \
+        "unsigned long long x[] = {0xffffffffffffffffULL}"
+
+
+@pytest.mark.skipif(not shutil.which("gcc"), reason="needs a compiler")
+def test_bulk_initializers_are_valid_c(tmp_path):
+    source = tmp_path / "literals.c"
+    source.write_text("\n".join([gut.self_check_includes,
+        rendered([float("nan"), float("inf"), float("-inf"), 1e-300], name="d") + ";",
+        rendered([2**64 - 1, 2**63], c_type="unsigned long long", name="u") + ";",
+        rendered([-2**63, -1, 2**63 - 1], c_type="long long", name="q") + ";",
+        "int main(void) { return !(q[0] == -0x7fffffffffffffffLL - 1 && u[0] == ~0ULL && isnan(d[0]) && isinf(d[2])); }", ""]))
+    result = subprocess.run(["gcc", "-std=c99", "-Werror", "-Wall", str(source), "-o", str(tmp_path / "literals")], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert subprocess.run([str(tmp_path / "literals")]).returncode == 0
+
+
+def sampled(calls, invocations, sampling, stride=1, seed=0):
+    # {slot: hit} kept after calls hits, stopping only where the Sampler asks like the breakpoints do
+    scope = {"math": math, "random": random, "invocations": invocations, "sampling": sampling, "stride": stride}
+    exec(gut.gdb_sampler_script, scope)
+    random.seed(seed)
+    sampler, slots, hit = scope["Sampler"](), {}, 1
+    while hit <= calls:
+        slot = sampler.slot(hit)
+        assert slot is not None # the ignore counts land on the hits to capture
+        slots[slot] = hit
+        skip = sampler.skip(hit)
+        if skip is None:
+            break
+        hit += skip + 1
+    return slots
+
+
+def test_stride_sampler():
+    assert sampled(100, 3, "stride", 4) == {0: 1, 1: 5, 2: 9}
+    assert sampled(6, 3, "stride", 4) == {0: 1, 1: 5}
+    assert sampled(2, 1, "stride") == {0: 1}
+
+
+def test_reservoir_sampler_is_uniform():
+    assert sampled(3, 5, "reservoir") == {0: 1, 1: 2, 2: 3}
+    counts = collections.Counter()
+    for seed in range(4000):
+        slots = sampled(20, 4, "reservoir", seed=seed)
+        assert len(slots) == 4 and len(set(slots.values())) == 4
+        counts.update(slots.values())
+    # each of the 20 calls is kept with probability 4/20
+    assert all(abs(counts[hit] / 4000 - 0.2) < 0.03 for hit in range(1, 21))
+
+
+sliced = {
+    "s.c": """#include <stdio.h>
+typedef unsigned int u32;
+struct point { u32 x, y; };
+enum mode { FAST, SLOW };
+static int counter;
+int unused_global = 3;
+int helper(int v);
+u32 norm(struct point *p) { return p->x + p->y; }
+int helper(int v) { counter++; return v * 2; }
+int other(void) { return unused_global; }
+int run(struct point *p, enum mode m) { return m == SLOW ? helper(norm(p)) : 0; }
+int main(void) { struct point p = {1, 2}; printf("%d\\n", run(&p, FAST) + other()); return 0; }
+""",
+}
+
+
+@pytest.mark.skipif(shutil.which("cpp") is None, reason="the sources are preprocessed with cpp")
+def test_slice_units_keeps_what_the_function_needs_in_source_order(tmp_path):
+    write_files(tmp_path, sliced)
+    cfg = source_cfg(tmp_path, "s.c")
+    gut.parse_source(cfg)
+    units = cfg.units_table["units"]
+    names = lambda funcs: [(units[i]["name"], units[i]["kind"]) for i in gut.slice_units(funcs, cfg)]
+    assert cfg.units_table["includes"] == ["#include <stdio.h>"]
+    assert names(["norm"]) == [("u32", "type"), (None, "type"), ("norm", "function")]
+    assert names(["helper"]) == [("counter", "global"), ("helper", "prototype"), ("helper", "function")]
+    assert names(["run"]) == [("u32", "type"), (None, "type"), (None, "type"), ("counter", "global"),
+                              ("helper", "prototype"), ("norm", "function"), ("helper", "function"), ("run", "function")]
+    assert names(["other"]) == [("unused_global", "global"), ("other", "function")]
+    assert names(["printf"]) == []
+
+
+@pytest.mark.skipif(not (shutil.which("cpp") and shutil.which("gcc")), reason="needs cpp and a compiler")
+def test_sliced_source_compiles_on_its_own(tmp_path):
+    write_files(tmp_path, sliced)
+    cfg = source_cfg(tmp_path, "s.c")
+    gut.parse_source(cfg)
+    (tmp_path / "run.c").write_text(gut.sliced_source(["run"], cfg))
+    assert "other" not in (tmp_path / "run.c").read_text()
+    result = subprocess.run(["gcc", "-c", "-Werror", str(tmp_path / "run.c"), "-o", str(tmp_path / "run.o")], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_run_process_streams_the_output(tmp_path):
+    lines = []
+    result = gut.run_process([sys.executable, "-c", "import sys; print('a'); print(sys.stdin.read().upper()); sys.exit(3)"],
+                             str(tmp_path / "log"), timeout=30, input="b\n", on_line=lines.append)
+    assert (result["returncode"], result["status"]) == (3, "ok")
+    assert result["tail"] == (tmp_path / "log").read_text() == "".join(lines) == "a\nB\n\n"
+
+
+def alive(pid):
+    # not a zombie either
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except OSError:
+        return False
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc")
+def test_run_process_kills_the_process_group_past_the_timeout(tmp_path):
+    # the child started in the background is killed with the shell
+    start = time.monotonic()
+    result = gut.run_process(["sh", "-c", f"sleep 60 & echo $! > {tmp_path}/pid; sleep 60"], str(tmp_path / "log"), timeout=0.5)
+    assert result["status"] == "timeout" and result["returncode"] < 0
+    assert time.monotonic() - start < 10
+    pid = int((tmp_path / "pid").read_text())
+    deadline = time.monotonic() + 5
+    while alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not alive(pid)
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc")
+def test_run_process_kills_the_process_group_past_the_memory_limit(tmp_path):
+    # the memory is held by a child of the process started
+    code = "import subprocess, sys; subprocess.run([sys.executable, '-c', 'import time; x = bytearray(200 << 20); time.sleep(60)'])"
+    result = gut.run_process([sys.executable, "-c", code], str(tmp_path / "log"), timeout=60, memory_limit=100 << 20)
+    assert result["status"] == "memory" and result["returncode"] < 0
+    assert gut.running_processes == set()
+
+
+# stands for gdb in the pool: sources python scripts and echoes
+fake_gdb = """
+import sys
+for line in sys.stdin:
+    if line.startswith("source "):
+        exec(open(line.split(None, 1)[1].strip()).read())
+    elif line.startswith("echo "):
+        print(line[5:], end="", flush=True)
+"""
+
+
+class FakeGdbPool(gut.GdbPool):
+    def start(self):
+        return subprocess.Popen([sys.executable, "-c", fake_gdb], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                bufsize=1, text=True, start_new_session=True)
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc")
+def test_gdb_pool_applies_the_limits_of_run_process(tmp_path):
+    pool = FakeGdbPool(1)
+    try:
+        (tmp_path / "ok.py").write_text("print('captured', flush=True)\n")
+        (tmp_path / "memory.py").write_text("import time\nx = bytearray(200 << 20)\ntime.sleep(60)\n")
+        (tmp_path / "slow.py").write_text("import time\ntime.sleep(60)\n")
+        assert pool.run(str(tmp_path / "ok.py"), str(tmp_path / "ok.log"), 30, 100 << 20) == "ok"
+        assert (tmp_path / "ok.log").read_text() == "captured\n"
+        assert pool.run(str(tmp_path / "memory.py"), str(tmp_path / "memory.log"), 30, 100 << 20) == "memory"
+        assert pool.run(str(tmp_path / "slow.py"), str(tmp_path / "slow.log"), 0.5, 100 << 20) == "timeout"
+        # the killed process was replaced
+        assert pool.run(str(tmp_path / "ok.py"), str(tmp_path / "ok.log")) == "ok"
+    finally:
+        pool.close()
+
+
+def capture_script(tmp_path, monkeypatch, name, **kwargs):
+    # the gdb script written by capture, gdb itself does not run
+    monkeypatch.setattr(gut, "run_process", lambda *args, **kwargs: {"status": "ok", "returncode": 0, "tail": ""})
+    cfg = gut.CFG(argparse.Namespace(tmp_folder=f"{tmp_path}/", top="run", file=str(tmp_path / "a.c")))
+    cfg.params_table = {"checkpoint": [], "run": []}
+    cfg.binary = str(tmp_path / "a.out")
+    assert gut.capture(["checkpoint", "run"], cfg, name, **kwargs) == {}
+    return (tmp_path / f"{name}_gdb.py").read_text()
+
+
+def test_checkpoint_mode_is_not_taken_from_the_capture_name(tmp_path, monkeypatch):
+    # --capture function names the session after the function, here one called checkpoint
+    assert "\ncheckpoint_at = None\n" in capture_script(tmp_path, monkeypatch, "checkpoint")
+    assert "\ncheckpoint_at = 'run'\n" in capture_script(tmp_path, monkeypatch, "session", checkpoint=True)
+
+
+class Breakpoint:
+    def __init__(self, *args, **kwargs):
+        self.hit_count = 0
+
+    def delete(self):
+        pass
+
+
+def fake_gdb_module():
+    # what the capture script uses of gdb when the program has no breakpoint to stop at
+    gdb = types.ModuleType("gdb")
+    gdb.handlers, gdb.commands = [], []
+    gdb.error, gdb.MemoryError = RuntimeError, MemoryError
+    gdb.execute = lambda command, to_string=False: gdb.commands.append(command)
+    gdb.selected_inferior = lambda: types.SimpleNamespace(pid=0)
+    gdb.events = types.SimpleNamespace(exited=types.SimpleNamespace(connect=gdb.handlers.append))
+    gdb.Breakpoint = gdb.FinishBreakpoint = Breakpoint
+    return gdb
+
+
+def test_warm_gdb_sessions_connect_the_exit_handler_once(tmp_path, monkeypatch):
+    script = capture_script(tmp_path, monkeypatch, "session")
+    script = script.replace("keep_alive = False", "keep_alive = True")
+    gdb = fake_gdb_module()
+    monkeypatch.setitem(sys.modules, "gdb", gdb)
+    session = {}
+    for _ in range(3):
+        exec(script, session)
+        assert gdb.commands[-1].startswith("run")
+    assert len(gdb.handlers) == 1
+    gdb.handlers[0](None)
+    exec(script, session)
+    assert session["exited"] == [False] # reset for each capture
@@ -0,0 +1,202 @@
+#-----------------------------------------------------------------
+# End-to-end benchmark of generate_unit_tests.py.
+#
+# Times each stage of the pipeline (parse, call graph, build, capture,
+# test generation) on the C files of tests/ and on synthetic programs
+# whose call graph size, depth, parameter count and buffer size are
+# varied one at a time. Results are written as JSON.
+#
+# Usage: python utils/benchmark/benchmark-pipeline.py [options]
+#        (from the root of the repository)
+#-----------------------------------------------------------------
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.extend(['.', '..'])
+
+import generate_unit_tests as gut
+
+
+STAGES = ["parse", "explore", "build", "capture", "generate"]
+
+# tops of the programs in tests/
+TEST_TOPS = {"AES.c": "Cipher", "global.c": "linearSearch", "local.c": "linearSearch", "struct.c": "averageColor", "dynamic.c": "linearSearch"}
+
+# synthetic workloads: each dimension is varied around the base, the others are kept
+BASE = {"funcs": 16, "depth": 4, "params": 2, "buf_size": 256}
+SWEEP = {
+    "funcs": [4, 16, 64, 256],
+    "depth": [1, 4, 16, 64],
+    "params": [1, 4, 16],
+    "buf_size": [16, 4096, 1 << 16, 1 << 20],
+}
+
+
+def synthetic_program(filename, funcs, depth, params, buf_size):
+    """Write a C program with funcs functions, arranged in call chains of
+    length depth below a common top. Every function takes params byte
+    buffers of buf_size bytes and their length.
+    """
+    args = ", ".join(f"uint8_t *b{k}" for k in range(params)) + ", int n"
+    names = ", ".join(f"b{k}" for k in range(params)) + ", n"
+    lines = ["#include <stdint.h>", "#include <stdio.h>", "#include <stdlib.h>", ""]
+    for i in range(funcs):
+        lines.append(f"void f{i}({args});")
+    lines.append(f"void top({args});")
+    lines.append("")
+    for i in range(funcs):
+        other = f"b{1 % params}"
+        lines.append(f"void f{i}({args})")
+        lines.append("{")
+        lines.append("    int i;")
+        lines.append("    for (i = 0; i < n; i++)")
+        lines.append(f"        b0[i] = (uint8_t)(b0[i] * 31 + {other}[(i + {i}) % n] + {i});")
+        if (i + 1) % depth and i + 1 < funcs:
+            lines.append(f"    f{i + 1}({names});")
+        lines.append("}")
+        lines.append("")
+    lines.append(f"void top({args})")
+    lines.append("{")
+    for i in range(0, funcs, depth):
+        lines.append(f"    f{i}({names});")
+    lines.append("}")
+    lines.append("")
+    lines.append("int main()")
+    lines.append("{")
+    lines.append("    int i, k;")
+    lines.append("    unsigned sum = 0;")
+    lines.append(f"    uint8_t *b[{params}];")
+    lines.append(f"    for (k = 0; k < {params}; k++) {{")
+    lines.append(f"        b[k] = malloc({buf_size});")
+    lines.append(f"        for (i = 0; i < {buf_size}; i++)")
+    lines.append("            b[k][i] = (uint8_t)(i * 7 + k);")
+    lines.append("    }")
+    lines.append("    top(" + ", ".join(f"b[{k}]" for k in range(params)) + f", {buf_size});")
+    lines.append(f"    for (i = 0; i < {buf_size}; i++)")
+    lines.append("        sum += b[0][i];")
+    lines.append('    printf("%u\\n", sum);')
+    lines.append("    return 0;")
+    lines.append("}")
+    with open(filename, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def measure_pipeline(filename, top, tmp_folder, options):
+    """Run the pipeline of generate_unit_tests.py once on filename.
+
+    Returns a dict with the elapsed time of each stage, in seconds.
+    """
+    args = argparse.Namespace(file=filename, top=top, tmp_folder=tmp_folder,
+                              capture=options.capture, invocations=options.invocations,
+                              sampling="stride", stride=1, seed=0, jobs=options.jobs,
+                              inline_limit=options.inline_limit, force=True)
+    times = dict.fromkeys(STAGES, 0.0)
+
+    @contextlib.contextmanager
+    def stage(name):
+        t1 = time.perf_counter()
+        yield
+        times[name] += time.perf_counter() - t1
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        cfg = gut.CFG(args)
+        with stage("parse"):
+            gut.parse_source(cfg)
+        with stage("explore"):
+            gut.explore_calls(cfg.top, cfg.hierarchical_calls, cfg)
+        funcs = cfg.hierarchical_calls
+        if cfg.capture == "native":
+            # the instrumented build is part of capture_native
+            with stage("capture"):
+                captures = gut.capture_native(funcs, cfg, "native")
+        else:
+            with stage("build"):
+                gut.build_binary(cfg)
+            with stage("capture"):
+                captures = gut.capture(funcs, cfg, cfg.capture) if cfg.capture in ("session", "checkpoint") else None
+        with stage("generate"):
+            gut.generate_all(cfg, captures, funcs)
+    times["total"] = sum(times[name] for name in STAGES)
+    return times
+
+
+def measure_workload(name, filename, top, options, params=None):
+    print('%-50s' % name, end='', flush=True)
+    runs = []
+    tmp_root = tempfile.mkdtemp(prefix="utg_bench_")
+    try:
+        for i in range(options.runs):
+            # a new folder per run keeps the parse and build caches cold, unless --warm
+            tmp_folder = os.path.join(tmp_root, "warm" if options.warm else str(i)) + "/"
+            os.makedirs(tmp_folder, exist_ok=True)
+            try:
+                runs.append(measure_pipeline(filename, top, tmp_folder, options))
+            except Exception as e:
+                print(f'  failed: {e}')
+                return {"name": name, "params": params, "error": str(e)}
+            print('.', sep='', end='', flush=True)
+    finally:
+        shutil.rmtree(tmp_root, ignore_errors=True)
+    keys = STAGES + ["total"]
+    mean = {k: statistics.mean(run[k] for run in runs) for k in keys}
+    stdev = {k: statistics.stdev(run[k] for run in runs) if len(runs) > 1 else 0.0 for k in keys}
+    print('    ' + '  '.join('%s: %.3f' % (k, mean[k]) for k in keys))
+    return {"name": name, "params": params, "runs": runs, "mean": mean, "stdev": stdev}
+
+
+NUM_RUNS = 3
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-stage benchmark of the unit test generation pipeline')
+    parser.add_argument('--capture', type=str, default="native", choices=["session", "checkpoint", "function", "native"], help='Capture backend to benchmark')
+    parser.add_argument('--compiler', type=str, default=None, help='Compiler used in place of the one of generate_unit_tests.py')
+    parser.add_argument('--runs', type=int, default=NUM_RUNS, help='Runs per workload')
+    parser.add_argument('--invocations', type=int, default=1, help='Calls captured per function')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes of the generation stage')
+    parser.add_argument('--inline_limit', type=int, default=4096, help='Bytes above which the buffers go to sidecar files instead of C initializers')
+    parser.add_argument('--warm', action='store_true', help='Keep the parse and build caches between runs')
+    parser.add_argument('--tests', type=str, default="tests", help='Folder with the C files to benchmark')
+    parser.add_argument('--no_synthetic', action='store_true', help='Only benchmark the files in --tests')
+    parser.add_argument('--dimension', type=str, default=None, choices=list(SWEEP), help='Only sweep this dimension of the synthetic programs')
+    parser.add_argument('-o', '--output', type=str, default="benchmark-pipeline.json", help='JSON file with the results')
+    options = parser.parse_args()
+    if options.compiler:
+        gut.compiler = options.compiler
+
+    results = []
+    for filename in sorted(os.listdir(options.tests)):
+        if filename in TEST_TOPS:
+            results.append(measure_workload(filename, os.path.join(options.tests, filename),
+                                            TEST_TOPS[filename], options))
+
+    if not options.no_synthetic:
+        src_folder = tempfile.mkdtemp(prefix="utg_synthetic_")
+        try:
+            for dimension, values in SWEEP.items():
+                if options.dimension and dimension != options.dimension:
+                    continue
+                for value in values:
+                    params = dict(BASE, **{dimension: value})
+                    name = "synthetic_" + "_".join(f"{k}{v}" for k, v in params.items())
+                    filename = os.path.join(src_folder, name + ".c")
+                    synthetic_program(filename, **params)
+                    result = measure_workload(name, filename, "top", options, params)
+                    result["dimension"] = dimension
+                    results.append(result)
+        finally:
+            shutil.rmtree(src_folder, ignore_errors=True)
+
+    with open(options.output, "w") as f:
+        json.dump({"python": platform.python_version(), "platform": platform.platform(),
+                   "capture": options.capture, "compiler": gut.compiler, "runs": options.runs,
+                   "warm": options.warm, "results": results}, f, indent=1)
+    print(f"Results written to {options.output}")
@@ -0,0 +1,86 @@
+#-----------------------------------------------------------------
+# Startup benchmark of generate_unit_tests.py.
+#
+# Times fresh interpreter runs of the tool where the work is near zero:
+# the import alone, --help, and a rerun on an unchanged file that finds
+# every test up to date (the pre-commit hook case). The rerun is timed
+# when the tool is started as a script and as a module, and from another
+# working directory. Results are written as JSON.
+#
+# Usage: python utils/benchmark/benchmark-startup.py [options]
+#        (from the root of the repository)
+#-----------------------------------------------------------------
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+NUM_RUNS = 10
+
+
+def scenarios(script, filename, top, tmp_folder):
+    """Return the commands to time, as (name, argv, cwd, env) tuples."""
+    folder, module = os.path.split(os.path.abspath(script))
+    module = os.path.splitext(module)[0]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [folder, os.environ.get("PYTHONPATH")])))
+    rerun = ["-f", os.path.abspath(filename), "-t", top, "--tmp_folder", tmp_folder, "--capture", "native"]
+    other_cwd = tempfile.gettempdir()
+    return [
+        ("import", [sys.executable, "-c", f"import {module}"], None, env),
+        ("help", [sys.executable, script, "--help"], None, None),
+        ("rerun_script", [sys.executable, script, *rerun], None, None),
+        ("rerun_module", [sys.executable, "-m", module, *rerun], None, env),
+        ("rerun_other_cwd", [sys.executable, "-m", module, *rerun], other_cwd, env),
+    ]
+
+
+def measure_scenario(name, argv, cwd, env, runs):
+    print('%-20s' % name, end='', flush=True)
+    times = []
+    for i in range(runs):
+        t1 = time.perf_counter()
+        result = subprocess.run(argv, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        elapsed = time.perf_counter() - t1
+        if result.returncode != 0:
+            error = result.stderr.decode(errors="replace").strip().splitlines()[-1:] or ["exit code %d" % result.returncode]
+            print(f'  failed: {error[0]}')
+            return {"name": name, "argv": argv, "error": error[0]}
+        times.append(elapsed)
+        print('.', sep='', end='', flush=True)
+    mean = statistics.mean(times)
+    stdev = statistics.stdev(times) if len(times) > 1 else 0.0
+    print('    mean: %.3f  stdev: %.3f  min: %.3f' % (mean, stdev, min(times)))
+    return {"name": name, "argv": argv, "runs": times, "mean": mean, "stdev": stdev, "min": min(times)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Startup benchmark of the unit test generator')
+    parser.add_argument('--script', type=str, default="generate_unit_tests.py", help='Copy of the tool to benchmark, e.g. one built with another compiler')
+    parser.add_argument('--file', type=str, default="tests/AES.c", help='C file of the rerun scenarios')
+    parser.add_argument('--top', type=str, default="Cipher", help='Top function of --file')
+    parser.add_argument('--runs', type=int, default=NUM_RUNS, help='Runs per scenario')
+    parser.add_argument('-o', '--output', type=str, default="benchmark-startup.json", help='JSON file with the results')
+    options = parser.parse_args()
+
+    tmp_folder = tempfile.mkdtemp(prefix="utg_startup_") + "/"
+    try:
+        results = []
+        for name, argv, cwd, env in scenarios(options.script, options.file, options.top, tmp_folder):
+            if name == "rerun_script":
+                # untimed first run, the timed ones find every test up to date
+                subprocess.run(argv, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            results.append(measure_scenario(name, argv, cwd, env, options.runs))
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    with open(options.output, "w") as f:
+        json.dump({"python": platform.python_version(), "platform": platform.platform(),
+                   "script": options.script, "runs": options.runs, "results": results}, f, indent=1)
+    print(f"Results written to {options.output}")